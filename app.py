@@ -1,19 +1,16 @@
 import collections
 import datetime
-import glob
-import io
 import json
 import os
 import re
 import time
-import uuid
 from zoneinfo import ZoneInfo
 
 import yaml
 from flask import Flask, jsonify, request, send_file, abort
-from PIL import Image
 from werkzeug.middleware.proxy_fix import ProxyFix
 
+import cache
 import combine
 import db
 import discord
@@ -33,14 +30,26 @@ app.wsgi_app = ProxyFix(app.wsgi_app, x_for=1, x_proto=1, x_host=1)
 
 _PAPERS_YAML_PATH = os.path.join(os.path.dirname(__file__), 'papers.yaml')
 _DOWNLOADS_DIR = os.path.join(os.path.dirname(__file__), 'downloads')
-_GENERATED_DIR = os.path.join(os.path.dirname(__file__), 'generated_images')
 
 _ET = ZoneInfo('America/New_York')
 DISCORD_DOMAINS = {'discord.com', 'discordapp.com'}
 AUTO_DEACTIVATE_THRESHOLD = 7
+# Cold /api/paper fetches start a paper's next source if the current one hasn't
+# answered within this many seconds; see fetch._hedged_fetch.
+_HEDGE_AFTER = 3.0
+_VARIANT_SIZES = {'small': 320, 'medium': 640, 'large': 960}
+_MAX_COMBINED_PAPERS = 12
+# New /api/combined renders (selections not already in generated_images/) per
+# IP per day; every distinct ordering of papers is its own file
+_MAX_COMBINED_RENDERS = 50
 _DISCORD_RE = re.compile(r'^https://(discord\.com|discordapp\.com)/api/webhooks/')
 _EMAIL_RE = re.compile(r'^[^\s@]+@[^\s@]+\.[^\s@]+$')
 _rate_buckets = collections.defaultdict(list)
+# (paper, date) -> (time until which we serve the fallback without refetching,
+# the other edition the failed fetch found or None). Per-source backoff on top
+# of this lives in health.py's cooldowns.
+_FETCH_FAILURE_TTL = 300
+_fetch_failures = {}
 
 
 def _today_et():
@@ -61,17 +70,18 @@ def _load_yaml():
         return yaml.safe_load(f)
 
 
-def _cached_paper_path(papername, d):
-    """Return existing downloaded file path for papername+date, or None."""
-    pattern = os.path.join(_DOWNLOADS_DIR, f'{d.isoformat()}-{papername}.*')
-    matches = glob.glob(pattern)
-    return matches[0] if matches else None
+def _delivery_options(max_bytes=None):
+    return {'max_height': combine.DELIVERY_MAX_HEIGHT, 'max_width': combine.DELIVERY_MAX_WIDTH,
+            'max_bytes': max_bytes}
 
 
-def _cached_combined_path(paper_keys, d):
-    label = '-'.join(sorted(paper_keys))
-    path = os.path.join(_GENERATED_DIR, f'{d.isoformat()}-{label}.jpg')
-    return path if os.path.exists(path) else None
+def _cached_combined_path(paper_keys, d, paths, trim_flags, max_bytes=None):
+    """Return the delivery-sized combined image for these covers.
+
+    Shared with deliver.py through cache.combined, so a test send for a paper
+    list someone already receives reuses the image rendered for them.
+    """
+    return cache.combined(paper_keys, d, paths, trim_flags, **_delivery_options(max_bytes))
 
 
 # ---------------------------------------------------------------------------
@@ -90,6 +100,22 @@ def _rate_limit(key, max_calls, window_seconds):
     return True
 
 
+def _recently_failed(key, d):
+    return _fetch_failures.get((key, d), (0, None))[0] > time.time()
+
+
+def _failure_fallback(key, d):
+    fallback = _fetch_failures.get((key, d), (0, None))[1]
+    return fallback if fallback and os.path.exists(fallback) else None
+
+
+def _record_fetch_failure(key, d, fallback=None):
+    now = time.time()
+    for k in [k for k, (until, _) in _fetch_failures.items() if until <= now]:
+        del _fetch_failures[k]
+    _fetch_failures[(key, d)] = (now + _FETCH_FAILURE_TTL, fallback)
+
+
 def _client_ip():
     return request.headers.get('X-Forwarded-For', request.remote_addr).split(',')[0].strip()
 
@@ -128,30 +154,129 @@ def api_paper(key):
 
     paper_cfg = cfg['papers'][key]
 
-    # Check disk cache first; fall back to yesterday if today unavailable
-    cached = _cached_paper_path(key, d)
-    if cached:
-        path = cached
-    else:
-        try:
-            path = fetch.fetch_paper(paper_cfg, key, d)
-        except RuntimeError:
+    # Check disk cache first; fall back to yesterday if today unavailable.
+    # A recent miss for this paper+date skips straight to the fallback so page
+    # loads before the edition is out don't re-run every source. Before
+    # publication most sources don't fail but return an older edition; that
+    # counts as a miss too, and the file they returned is the fallback.
+    path = cache.lookup(key, d)
+    if not path:
+        fallback = None
+        if _recently_failed(key, d):
+            fallback = _failure_fallback(key, d)
+        else:
+            try:
+                fetched = fetch.fetch_paper(paper_cfg, key, d, hedge_after=_HEDGE_AFTER)
+            except RuntimeError:
+                _record_fetch_failure(key, d)
+            else:
+                path = cache.lookup(key, d)
+                if not path:
+                    fallback = fetched
+                    _record_fetch_failure(key, d, fallback)
+        if not path:
             yesterday = d - datetime.timedelta(days=1)
-            path = _cached_paper_path(key, yesterday)
+            path = fallback or cache.lookup(key, yesterday)
             if not path:
                 abort(502)
         path = os.path.abspath(path)
 
     if paper_cfg.get('trim_whitespace'):
-        img = combine._trim_whitespace(Image.open(path).convert('RGB'))
-        buf = io.BytesIO()
-        img.save(buf, 'JPEG')
-        buf.seek(0)
-        return send_file(buf, mimetype='image/jpeg')
+        path = cache.trimmed(path)
+
+    # Optional ?w=<px> or ?size=small|medium|large picks the smallest prebuilt
+    # variant at least that wide, as WebP when the browser accepts it
+    width = _requested_width()
+    if width:
+        ext = 'webp' if 'image/webp' in request.headers.get('Accept', '') else 'jpg'
+        fitting = [w for w in cache.VARIANT_WIDTHS if w >= width]
+        if fitting:
+            path = cache.variant(path, fitting[0], ext)
+        resp = send_file(path)
+        resp.vary.add('Accept')
+        return resp
 
     return send_file(path)
 
 
+def _requested_width():
+    size = request.args.get('size')
+    if size:
+        if size not in _VARIANT_SIZES:
+            abort(400)
+        return _VARIANT_SIZES[size]
+    width = request.args.get('w')
+    if width is None:
+        return None
+    try:
+        width = int(width)
+    except ValueError:
+        abort(400)
+    if width <= 0:
+        abort(400)
+    return width
+
+
+@app.route('/api/combined')
+def api_combined():
+    """Combined image of ?papers=a,b,c for ?date=, for shared links and embeds.
+
+    Served from the content-addressed generated_images/ file when all covers
+    are cached; concurrent requests for the same selection share one fetch
+    and render. Each IP may trigger _MAX_COMBINED_RENDERS new renders a day.
+    """
+    ip = _client_ip()
+    if not _rate_limit(f'combined:{ip}', max_calls=10, window_seconds=60):
+        abort(429)
+
+    keys = [k for k in (request.args.get('papers') or '').split(',') if k]
+    if not keys or len(keys) > _MAX_COMBINED_PAPERS or len(set(keys)) < len(keys):
+        abort(400)
+
+    date_str = request.args.get('date')
+    try:
+        d = datetime.date.fromisoformat(date_str) if date_str else _today_et()
+    except ValueError:
+        abort(400)
+
+    cfg = _load_yaml()
+    if any(k not in cfg['papers'] for k in keys):
+        abort(404)
+
+    # fetch_paper and cache.combined each collapse concurrent identical work
+    try:
+        paths, trim_flags = _fetch_papers(keys, cfg, d)
+    except RuntimeError:
+        abort(502)
+    path = cache.combined_path(keys, d, paths, trim_flags, **_delivery_options())
+    if not os.path.exists(path):
+        if not _rate_limit(f'combined-render:{ip}', max_calls=_MAX_COMBINED_RENDERS, window_seconds=86400):
+            abort(429)
+        path = _cached_combined_path(keys, d, paths, trim_flags)
+
+    # Today's covers can still be replaced by a later edition; past days are final
+    max_age = 300 if d >= _today_et() else 86400
+    resp = send_file(path, mimetype='image/jpeg', max_age=max_age)
+    resp.cache_control.public = True
+    return resp
+
+
+@app.route('/covers/<name>')
+def covers(name):
+    """A combined image from generated_images/, linked from Discord deliveries.
+
+    Names are content hashes, so a URL's bytes never change and can be cached
+    for good.
+    """
+    path = cache.generated_file(name)
+    if path is None:
+        abort(404)
+    resp = send_file(path, mimetype='image/jpeg', max_age=365 * 86400)
+    resp.cache_control.public = True
+    resp.cache_control.immutable = True
+    return resp
+
+
 @app.route('/')
 def index():
     return app.send_static_file('index.html')
@@ -271,8 +396,6 @@ def create_subscription():
         return jsonify({'error': f'Unknown paper keys: {invalid}'}), 400
 
     today = _today_et()
-    combined_path = os.path.join(_GENERATED_DIR, f'{today.isoformat()}-test-{uuid.uuid4().hex[:8]}.jpg')
-    os.makedirs(_GENERATED_DIR, exist_ok=True)
 
     # For email subs, create the record first so the test email carries the real unsubscribe ID.
     # For Discord, keep the original order (webhook validity is proven by the test post).
@@ -285,7 +408,8 @@ def create_subscription():
 
     try:
         paths, trim_flags = _fetch_papers(papers, cfg, today)
-        combine.combine(paths, combined_path, trim_flags)
+        max_bytes = email_delivery.MAX_IMAGE_BYTES if sub_type == 'email' else discord.MAX_UPLOAD_BYTES
+        combined_path = _cached_combined_path(papers, today, paths, trim_flags, max_bytes)
         if sub_type == 'email':
             email_delivery.send(combined_path, today, to_email=destination, label=label, sub_id=sub['id'])
         else:
@@ -296,11 +420,6 @@ def create_subscription():
         if sub:
             db.deactivate_subscription(sub['id'])
         return jsonify({'error': f'Test delivery error: {e}'}), 400
-    finally:
-        try:
-            os.remove(combined_path)
-        except OSError:
-            pass
 
     if not sub:
         sub = db.create_subscription(
@@ -331,17 +450,20 @@ def delete_subscription():
 # ---------------------------------------------------------------------------
 
 def _fetch_papers(paper_keys, cfg, d):
-    paths = []
-    trim_flags = []
+    found = {}
     for key in paper_keys:
-        paper_cfg = cfg['papers'][key]
-        cached = _cached_paper_path(key, d)
+        cached = cache.lookup(key, d)
         if cached:
-            path = cached
-        else:
-            path = fetch.fetch_paper(paper_cfg, key, d)
-        paths.append(path)
-        trim_flags.append(paper_cfg.get('trim_whitespace', False))
+            found[key] = cached
+
+    fetched, errors = fetch.fetch_many(cfg, [k for k in paper_keys if k not in found], d)
+    for key in paper_keys:
+        if key in errors:
+            raise errors[key]
+    found.update(fetched)
+
+    paths = [found[key] for key in paper_keys]
+    trim_flags = [cfg['papers'][key].get('trim_whitespace', False) for key in paper_keys]
     return paths, trim_flags
 
 
@@ -0,0 +1,193 @@
+"""bench.py — micro-benchmarks for the fetch/combine hot paths.
+
+    python bench.py regex [page.html ...]   # precompiled scrapers vs re.search
+    python bench.py trim [cover.jpg ...]    # combine._trim_bbox vs the original full-frame trim
+    python bench.py combine [cover.jpg ...] # combine() on one thread vs --workers threads
+    python bench.py memory [cover.jpg ...]  # peak RSS vs number of papers, default vs streaming
+
+regex: pass saved copies of real source pages to benchmark against them;
+otherwise a synthetic page of roughly frontpages.com size is used.
+trim, combine, memory: default to every cover in downloads/. memory copies
+the covers as needed to reach --max-papers distinct files, and measures each
+point in a fresh process so peaks don't carry over.
+"""
+
+import argparse
+import base64
+import glob
+import os
+import re
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import timeit
+
+from PIL import Image, ImageChops
+
+import cache
+import combine
+import fetch
+
+
+def _synthetic_page():
+    filler = '<div class="row"><a href="/paper/x/">Some paper</a></div>\n' * 2500
+    image_path = base64.b64encode(b'/newspapers/2026-03-01/the-new-york-times-abc123.webp').decode()
+    return (
+        '<html><head><script type="application/ld+json">'
+        '{"@type": "NewsArticle", "dateModified": "2026-03-01T07:12:00+01:00"}</script></head><body>'
+        + filler
+        + f"<script>var s = atob('{image_path}');</script>"
+        + '<img id="giornale-img" class="big rttx" src="">'
+        + 'https://img.kiosko.net/2026/03/01/us/wsj.750.jpg '
+        + 'https://nypost.com/wp-content/uploads/sites/2/2026/03/NYP_P1_LCF.P1_LCF.jpg '
+        + filler
+        + '</body></html>'
+    )
+
+
+# (name, raw pattern as the scrapers used to pass it to re.search, precompiled equivalent)
+_EXTRACTORS = [
+    ('frontpages date', r'"dateModified"\s*:\s*"(\d{4}-\d{2}-\d{2})', fetch._FRONTPAGES_DATE_RE),
+    ('frontpages path', r"atob\('([A-Za-z0-9+/=]+)'\)", fetch._FRONTPAGES_PATH_RE),
+    ('frontpages mirror', r'id="giornale-img"[^>]*class="[^"]*rttx', fetch._FRONTPAGES_MIRROR_RES[0]),
+    ('kiosko date', r'img\.kiosko\.net/(\d{4}/\d{2}/\d{2})', fetch._KIOSKO_DATE_RE),
+    ('nypost P1', r'https://nypost\.com/wp-content/uploads/sites/2/\d{4}/\d{2}/\w+\.P1[^\s"\'<]+\.jpg',
+     fetch._NYPOST_P1_RE),
+]
+
+
+def bench_regex(pages, number):
+    for label, html in pages:
+        print(f'{label}: {len(html) / 1024:.0f} KB')
+        for name, raw, compiled in _EXTRACTORS:
+            raw_m = re.search(raw, html)
+            compiled_m = compiled.search(html)
+            assert (raw_m and raw_m.group(0)) == (compiled_m and compiled_m.group(0)), name
+            t_raw = timeit.timeit(lambda: re.search(raw, html), number=number) / number
+            t_compiled = timeit.timeit(lambda: compiled.search(html), number=number) / number
+            print(f'  {name:18} re.search {t_raw * 1e6:8.1f} us   compiled {t_compiled * 1e6:8.1f} us'
+                  f'   ({t_raw / t_compiled:.2f}x)')
+
+
+def _legacy_trim_bbox(img):
+    """combine._trim_whitespace's bbox as originally written: three full-frame passes."""
+    bg = Image.new('RGB', img.size, (255, 255, 255))
+    diff = ImageChops.difference(img.convert('RGB'), bg)
+    diff = diff.point(lambda p: 0 if p < 10 else 255)
+    return diff.getbbox()
+
+
+def bench_trim(paths, number):
+    total_old = total_new = 0
+    for path in paths:
+        img = Image.open(path).convert('RGB')
+        old_box = _legacy_trim_bbox(img)
+        new_box = combine._trim_bbox(img)
+        if old_box != new_box:
+            print(f'  MISMATCH {os.path.basename(path)}: {old_box} vs {new_box}')
+        t_old = timeit.timeit(lambda: _legacy_trim_bbox(img), number=number) / number
+        t_new = timeit.timeit(lambda: combine._trim_bbox(img), number=number) / number
+        total_old += t_old
+        total_new += t_new
+        print(f'  {os.path.basename(path):40} {img.size[0]}x{img.size[1]:<5}'
+              f' old {t_old * 1e3:7.1f} ms   new {t_new * 1e3:7.1f} ms   ({t_old / t_new:.1f}x)')
+    if paths:
+        print(f'total: old {total_old * 1e3:.1f} ms, new {total_new * 1e3:.1f} ms ({total_old / total_new:.1f}x)')
+
+
+def _combine_cold(paths, output_path, workers):
+    """One combine() at delivery size with the tile cache emptied first."""
+    with combine._cache_lock:
+        combine._tiles.clear()
+        combine._tiles_bytes = 0
+        combine._trim_boxes.clear()
+    combine.combine(paths, output_path, [True] * len(paths), max_height=combine.DELIVERY_MAX_HEIGHT,
+                    max_width=combine.DELIVERY_MAX_WIDTH, workers=workers)
+
+
+def bench_combine(paths, number, workers):
+    with tempfile.TemporaryDirectory() as tmp:
+        serial_path = os.path.join(tmp, 'serial.jpg')
+        parallel_path = os.path.join(tmp, 'parallel.jpg')
+        _combine_cold(paths, serial_path, None)
+        _combine_cold(paths, parallel_path, workers)
+        if open(serial_path, 'rb').read() != open(parallel_path, 'rb').read():
+            print('  MISMATCH: parallel output differs from serial')
+        t_serial = timeit.timeit(lambda: _combine_cold(paths, serial_path, None), number=number) / number
+        t_parallel = timeit.timeit(lambda: _combine_cold(paths, parallel_path, workers), number=number) / number
+    print(f'{len(paths)} covers: serial {t_serial * 1e3:.0f} ms, {workers} workers {t_parallel * 1e3:.0f} ms'
+          f' ({t_serial / t_parallel:.1f}x)')
+
+
+def _peak_rss_child(mode, paths):
+    """Run one full-height combine() and print this process's peak RSS in MB."""
+    combine.combine(paths, os.path.join(os.path.dirname(paths[0]), 'out.jpg'), [True] * len(paths),
+                    streaming=(mode == 'streaming'))
+    print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024)
+
+
+def bench_memory(paths, max_papers):
+    with tempfile.TemporaryDirectory() as tmp:
+        copies = []
+        for i in range(max_papers):
+            copies.append(os.path.join(tmp, f'{i:02d}-{os.path.basename(paths[i % len(paths)])}'))
+            shutil.copyfile(paths[i % len(paths)], copies[-1])
+        print(f'{"papers":>6}  {"default MB":>10}  {"streaming MB":>12}')
+        for n in sorted({1, 2, 4, 8, 16, 24, 32, max_papers} & set(range(1, max_papers + 1))):
+            peaks = []
+            for mode in ('default', 'streaming'):
+                out = subprocess.run([sys.executable, __file__, '_rss', mode, *copies[:n]],
+                                     capture_output=True, text=True, check=True).stdout
+                peaks.append(float(out.split()[-1]))
+            print(f'{n:>6}  {peaks[0]:>10.0f}  {peaks[1]:>12.0f}')
+
+
+def _default_covers():
+    return sorted(p for p in glob.glob(os.path.join(cache.DOWNLOADS_DIR, '*'))
+                  if cache._COVER_RE.match(os.path.basename(p)))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    sub = parser.add_subparsers(dest='bench', required=True)
+    p = sub.add_parser('regex', help='HTML scraper extractors')
+    p.add_argument('pages', nargs='*')
+    p.add_argument('--number', type=int, default=200)
+    p = sub.add_parser('trim', help='whitespace-trim bounding box')
+    p.add_argument('images', nargs='*')
+    p.add_argument('--number', type=int, default=5)
+    p = sub.add_parser('combine', help='serial vs threaded tile processing')
+    p.add_argument('images', nargs='*')
+    p.add_argument('--number', type=int, default=3)
+    p.add_argument('--workers', type=int, default=os.cpu_count())
+    p = sub.add_parser('memory', help='peak RSS against number of papers')
+    p.add_argument('images', nargs='*')
+    p.add_argument('--max-papers', type=int, default=30)
+    p = sub.add_parser('_rss')
+    p.add_argument('mode', choices=('default', 'streaming'))
+    p.add_argument('images', nargs='+')
+    args = parser.parse_args()
+
+    if args.bench == '_rss':
+        _peak_rss_child(args.mode, args.images)
+        return
+
+    if args.bench == 'regex':
+        pages = [(path, open(path, encoding='utf-8', errors='replace').read()) for path in args.pages]
+        bench_regex(pages or [('synthetic', _synthetic_page())], args.number)
+    else:
+        paths = args.images or _default_covers()
+        if not paths:
+            parser.error('no covers in downloads/; pass image paths explicitly')
+        if args.bench == 'trim':
+            bench_trim(paths, args.number)
+        elif args.bench == 'combine':
+            bench_combine(paths, args.number, args.workers)
+        else:
+            bench_memory(paths, args.max_papers)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,327 @@
+"""cache.py — index of the cover images saved in downloads/.
+
+fetch.py records every cover it saves here, keyed by (paper, date), with its
+path, format, size and fetch time. Lookups are then a primary-key query
+instead of a glob over a directory that grows by ~30 files a day. Entries
+whose file has since been deleted are dropped on lookup.
+
+Derived images (e.g. trimmed covers) live next to their original as
+{date}-{paper}.{suffix} and are rebuilt whenever the original is newer.
+
+Combined images are content-addressed in generated_images/ (see combined()),
+so every subscription or request wanting the same tiling of the same covers
+shares one file. Since a name never changes content, the webapp publishes
+them as immutable /covers/<name> URLs for Discord embeds to link to. Nothing
+else deletes them, so prefetch.py calls prune_generated() to drop those past
+GENERATED_KEEP_DAYS and keep the directory under GENERATED_MAX_BYTES.
+
+The index is backfilled from the directory automatically the first time it is
+opened empty. To rebuild it by hand (e.g. after copying covers in):
+    python cache.py --rebuild
+"""
+
+import datetime
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+from PIL import Image
+
+import combine
+import singleflight
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DOWNLOADS_DIR = os.path.join(BASE_DIR, 'downloads')
+INDEX_PATH = os.path.join(DOWNLOADS_DIR, 'index.db')
+GENERATED_DIR = os.path.join(BASE_DIR, 'generated_images')
+# Retention for content-addressed combined images (see prune_generated). Long
+# enough that Discord embeds linking to /covers/<name> outlive their day.
+GENERATED_KEEP_DAYS = 30
+GENERATED_MAX_BYTES = 2 * 1024 ** 3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS covers (
+    paper      TEXT    NOT NULL,
+    date       TEXT    NOT NULL,
+    path       TEXT    NOT NULL,
+    format     TEXT    NOT NULL,
+    size       INTEGER NOT NULL,
+    fetched_at TEXT    NOT NULL,
+    PRIMARY KEY (paper, date)
+);
+"""
+
+# {date}-{paper}.{ext}; paper keys never contain dots, so derived files
+# like 2026-03-01-newsday.trimmed.jpg don't match.
+_COVER_RE = re.compile(r'^(\d{4}-\d{2}-\d{2})-([^.]+)\.(jpg|jpeg|png|webp|gif)$', re.IGNORECASE)
+
+_initialized = False
+_init_lock = threading.Lock()
+
+
+def _connect():
+    global _initialized
+    os.makedirs(DOWNLOADS_DIR, exist_ok=True)
+    conn = sqlite3.connect(INDEX_PATH)
+    conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA journal_mode=WAL')
+    if not _initialized:
+        # Other threads wait here rather than query a covers table that
+        # doesn't exist yet; the flag only flips once the schema is in place.
+        with _init_lock:
+            if not _initialized:
+                conn.executescript(SCHEMA)
+                if conn.execute('SELECT COUNT(*) FROM covers').fetchone()[0] == 0:
+                    _scan(conn)
+                _initialized = True
+    return conn
+
+
+def _format(path):
+    ext = os.path.splitext(path)[1].lower().lstrip('.')
+    return 'jpeg' if ext == 'jpg' else ext
+
+
+def _upsert(conn, paper, date_str, path, fetched_at):
+    conn.execute(
+        """INSERT OR REPLACE INTO covers (paper, date, path, format, size, fetched_at)
+           VALUES (?, ?, ?, ?, ?, ?)""",
+        (paper, date_str, path, _format(path), os.path.getsize(path), fetched_at),
+    )
+
+
+def _scan(conn):
+    """Index every cover file in downloads/. Returns the number indexed."""
+    count = 0
+    for name in os.listdir(DOWNLOADS_DIR):
+        m = _COVER_RE.match(name)
+        if not m:
+            continue
+        path = os.path.join(DOWNLOADS_DIR, name)
+        mtime = datetime.datetime.utcfromtimestamp(os.path.getmtime(path)).isoformat()
+        _upsert(conn, m.group(2), m.group(1), path, mtime)
+        count += 1
+    return count
+
+
+def record(paper, d, path):
+    """Register a freshly saved cover for paper on date d."""
+    now = datetime.datetime.utcnow().isoformat()
+    with _connect() as conn:
+        _upsert(conn, paper, d.isoformat(), os.path.abspath(path), now)
+
+
+def entry(paper, d):
+    """Return the index row for (paper, d) as a dict, or None if not cached."""
+    with _connect() as conn:
+        row = conn.execute('SELECT * FROM covers WHERE paper = ? AND date = ?',
+                           (paper, d.isoformat())).fetchone()
+        if row is None:
+            return None
+        if not os.path.exists(row['path']):
+            conn.execute('DELETE FROM covers WHERE paper = ? AND date = ?', (paper, d.isoformat()))
+            return None
+    return dict(row)
+
+
+def lookup(paper, d):
+    """Return the cached cover path for (paper, d), or None."""
+    row = entry(paper, d)
+    return row['path'] if row else None
+
+
+def _derived_path(path, suffix):
+    """downloads/2026-03-01-newsday.jpg -> downloads/2026-03-01-newsday.{suffix}"""
+    return f'{os.path.splitext(path)[0]}.{suffix}'
+
+
+def _is_fresh(derived, source):
+    try:
+        return os.path.getmtime(derived) >= os.path.getmtime(source)
+    except OSError:
+        return False
+
+
+def _save_atomic(img, path, fmt, **params):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.partial-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            img.save(f, fmt, **params)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def trimmed(path):
+    """Return the whitespace-trimmed JPEG derived from a cover, building it if needed.
+
+    Stored next to the original as {date}-{paper}.trimmed.jpg and rebuilt only
+    when the original is newer, so trim_whitespace papers are served as a
+    static file instead of being decoded and re-encoded per request.
+    """
+    derived = _derived_path(path, 'trimmed.jpg')
+    if not _is_fresh(derived, path):
+        with Image.open(path) as img:
+            trimmed_img = combine._trim_whitespace(img.convert('RGB'))
+        _save_atomic(trimmed_img, derived, 'JPEG')
+    return derived
+
+
+VARIANT_WIDTHS = (320, 640, 960)
+VARIANT_FORMATS = {'webp': ('WEBP', {'quality': 80, 'method': 4}),
+                   'jpg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True})}
+
+
+def variant(path, width, ext):
+    """Return a cover resized to `width` px wide in format ext ('webp' or 'jpg').
+
+    Built on first use as {date}-{paper}.w{width}.{ext} (or .trimmed.w...) and
+    rebuilt when the original is newer. Covers already no wider than `width`
+    are returned as-is rather than re-encoded.
+    """
+    derived = _derived_path(path, f'w{width}.{ext}')
+    if _is_fresh(derived, path):
+        return derived
+    with Image.open(path) as img:
+        w, h = img.size
+        if w <= width:
+            return path
+        img.draft('RGB', (width, round(h * width / w)))
+        resized = img.convert('RGB').resize((width, round(h * width / w)), Image.LANCZOS)
+    fmt, params = VARIANT_FORMATS[ext]
+    _save_atomic(resized, derived, fmt, **params)
+    return derived
+
+
+def build_variants(path):
+    for width in VARIANT_WIDTHS:
+        for ext in VARIANT_FORMATS:
+            variant(path, width, ext)
+
+
+def combined_path(paper_keys, d, paths, trim_flags, missing=(), **combine_kwargs):
+    """Content-addressed generated_images/ path for a combined image.
+
+    The name hashes the ordered paper list, trim flags, missing papers,
+    combine() options and each source cover's (path, size, mtime), so equal
+    requests map to one file and a re-fetched cover yields a new one.
+    combine()'s `workers` doesn't change the output and is left out.
+    """
+    options = {k: v for k, v in combine_kwargs.items() if k != 'workers'}
+    sources = []
+    for path in paths:
+        st = os.stat(path)
+        sources.append([os.path.abspath(path), st.st_size, st.st_mtime_ns])
+    key = json.dumps([list(paper_keys), list(trim_flags), sorted(missing), sources, options],
+                     sort_keys=True)
+    digest = hashlib.sha1(key.encode()).hexdigest()[:16]
+    return os.path.join(GENERATED_DIR, f'{d.isoformat()}-{digest}.jpg')
+
+
+_COMBINED_RE = re.compile(r'^\d{4}-\d{2}-\d{2}-[0-9a-f]{16}\.jpg$')
+
+
+def generated_file(name):
+    """Path of the combined image called `name` in generated_images/, or None.
+
+    Only content-addressed names as made by combined_path() are accepted, so
+    the name can come straight from a URL.
+    """
+    if not _COMBINED_RE.match(name):
+        return None
+    path = os.path.join(GENERATED_DIR, name)
+    return path if os.path.isfile(path) else None
+
+
+def combined(paper_keys, d, paths, trim_flags, missing=(), **combine_kwargs):
+    """Return the combined image for these covers, rendering it only if needed.
+
+    Concurrent callers wanting the same image wait for a single render, which
+    is written to a temp file and renamed into place.
+    """
+    path = combined_path(paper_keys, d, paths, trim_flags, missing, **combine_kwargs)
+
+    def render():
+        if os.path.exists(path):
+            return path
+        tmp_path = os.path.join(GENERATED_DIR, f'.partial-{os.getpid()}-{os.path.basename(path)}')
+        try:
+            combine.combine(paths, tmp_path, trim_flags, **combine_kwargs)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        return path
+
+    if os.path.exists(path):
+        return path
+    return singleflight.do(('combined', path), render)
+
+
+def prune_generated(keep_days=GENERATED_KEEP_DAYS, max_bytes=GENERATED_MAX_BYTES):
+    """Delete combined images older than keep_days, then the oldest until the
+    rest fit in max_bytes. Leftover .partial- files from a crashed render go
+    after a day. Other files in generated_images/ are left alone.
+
+    Returns (files deleted, bytes freed).
+    """
+    if not os.path.isdir(GENERATED_DIR):
+        return 0, 0
+    now = time.time()
+    doomed = []
+    kept = []
+    for name in os.listdir(GENERATED_DIR):
+        if name.startswith('.partial-'):
+            max_age = 86400
+        elif _COMBINED_RE.match(name):
+            max_age = keep_days * 86400
+        else:
+            continue
+        path = os.path.join(GENERATED_DIR, name)
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            continue
+        if now - st.st_mtime > max_age:
+            doomed.append((path, st.st_size))
+        elif _COMBINED_RE.match(name):
+            kept.append((st.st_mtime, path, st.st_size))
+
+    total = sum(size for _, _, size in kept)
+    for _, path, size in sorted(kept):
+        if total <= max_bytes:
+            break
+        doomed.append((path, size))
+        total -= size
+
+    deleted = freed = 0
+    for path, size in doomed:
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            continue
+        deleted += 1
+        freed += size
+    return deleted, freed
+
+
+def rebuild():
+    with _connect() as conn:
+        conn.execute('DELETE FROM covers')
+        return _scan(conn)
+
+
+if __name__ == '__main__':
+    if '--rebuild' in sys.argv[1:]:
+        print(f'Indexed {rebuild()} cover(s) in {INDEX_PATH}')
+    else:
+        print(f'usage: {sys.argv[0]} --rebuild', file=sys.stderr)
+        sys.exit(2)
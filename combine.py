@@ -1,45 +1,347 @@
+import collections
+import io
+import math
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 from PIL import Image, ImageChops
 
 
+# A pixel is content if any channel is at least 10 below white, i.e. <= 245
+_CONTENT_LUT = [255 if v <= 245 else 0 for v in range(256)]
+_TRIM_PROBE_SCALE = 8
+
+# Output caps for delivered images; Discord and mail clients show them far
+# smaller than this anyway.
+DELIVERY_MAX_HEIGHT = 1600
+DELIVERY_MAX_WIDTH = 6400
+
+# encode_jpeg() tries these in turn when given a byte budget. 75 is Pillow's
+# default, so a budgeted file is never larger than an unbudgeted one.
+_QUALITY_LADDER = (75, 65, 55, 45, 35)
+_MAX_DOWNSCALES = 4
+
+# Height-normalized tiles (LRU, bounded by decoded bytes) and per-source trim
+# boxes, shared by every combine() call in the process
+_TILE_CACHE_BYTES = 128 * 1024 * 1024
+_TRIM_BOXES_MAX = 1024
+# Selections larger than this are composed one tile at a time (see _compose_streaming)
+STREAMING_MIN_TILES = 10
+_MISSING = object()
+_tiles = collections.OrderedDict()
+_tiles_bytes = 0
+_trim_boxes = {}
+_cache_lock = threading.Lock()
+
+
+def _content_bbox(img):
+    """Exact bounding box of the non-white pixels of an RGB image, or None."""
+    r, g, b = img.split()
+    darkest = ImageChops.darker(ImageChops.darker(r, g), b)
+    return darkest.point(_CONTENT_LUT).getbbox()
+
+
+def _trim_bbox(img):
+    """Bounding box of non-white content, found on a 1/8-scale probe and refined at full res.
+
+    Each probe pixel is the mean of an 8x8 block, so a probe pixel that counts
+    as content guarantees a content pixel in its block. The exact edges thus
+    lie between the image border and the outermost such blocks, and only
+    those margin strips are scanned at full resolution.
+    """
+    w, h = img.size
+    s = _TRIM_PROBE_SCALE
+    if min(w, h) < s * 16:
+        return _content_bbox(img)
+    coarse = _content_bbox(img.reduce(s))
+    if coarse is None:
+        # Nothing dark enough to survive averaging; fall back to the exact scan
+        return _content_bbox(img)
+    cl, ct, cr, cb = coarse
+    x1 = min((cl + 1) * s, w)
+    y1 = min((ct + 1) * s, h)
+    x2 = min((cr - 1) * s, w)
+    y2 = min((cb - 1) * s, h)
+    left = _content_bbox(img.crop((0, 0, x1, h)))[0]
+    top = _content_bbox(img.crop((0, 0, w, y1)))[1]
+    right = x2 + _content_bbox(img.crop((x2, 0, w, h)))[2]
+    bottom = y2 + _content_bbox(img.crop((0, y2, w, h)))[3]
+    return left, top, right, bottom
+
+
 def _trim_whitespace(img):
-    bg = Image.new('RGB', img.size, (255, 255, 255))
-    diff = ImageChops.difference(img.convert('RGB'), bg)
-    diff = diff.point(lambda p: 0 if p < 10 else 255)
-    bbox = diff.getbbox()
+    bbox = _trim_bbox(img.convert('RGB'))
     if bbox:
         return img.crop(bbox)
     return img
 
 
-def combine(paths, output_path, trim_flags=None):
-    os.makedirs(os.path.dirname(output_path), exist_ok=True)
-    if trim_flags is None:
-        trim_flags = [False] * len(paths)
+def _target_height(sizes, max_height=None, max_width=None):
+    """Common tile height: the tallest tile, within max_height and the max_width budget."""
+    height = max(h for _, h in sizes)
+    if max_height:
+        height = min(height, max_height)
+    if max_width:
+        height = min(height, int(max_width / sum(w / h for w, h in sizes)))
+    return max(height, 1)
+
+
+def _encode(img, quality):
+    buf = io.BytesIO()
+    img.save(buf, 'JPEG', quality=quality, optimize=True, progressive=True)
+    return buf.getvalue()
+
+
+def encode_jpeg(img, output_path, max_bytes=None):
+    """Save img as JPEG, fitting it into max_bytes if given, and print size and encode time.
+
+    With a budget, takes the highest quality on _QUALITY_LADDER (optimized,
+    progressive) whose output fits; if even the lowest doesn't, scales the
+    image down by the square root of the overshoot and tries again, up to
+    _MAX_DOWNSCALES times. Raises RuntimeError, writing nothing, if the image
+    still doesn't fit.
+    """
+    start = time.monotonic()
+    if max_bytes is None:
+        img.save(output_path, 'JPEG')
+        size, quality = os.path.getsize(output_path), 75
+    else:
+        for attempt in range(_MAX_DOWNSCALES + 1):
+            if attempt:
+                scale = math.sqrt(max_bytes / len(data)) * 0.95
+                w, h = img.size
+                img = img.resize((max(1, int(w * scale)), max(1, int(h * scale))), Image.LANCZOS)
+            for quality in _QUALITY_LADDER:
+                data = _encode(img, quality)
+                if len(data) <= max_bytes:
+                    break
+            if len(data) <= max_bytes:
+                break
+        else:
+            raise RuntimeError(f'{img.size[0]}x{img.size[1]} still encodes to {len(data) / 1024:.0f} KB at'
+                               f' q{quality} after {_MAX_DOWNSCALES} downscales (budget {max_bytes / 1024:.0f} KB)')
+        with open(output_path, 'wb') as f:
+            f.write(data)
+        size = len(data)
+    budget = f' (budget {max_bytes / 1024:.0f} KB)' if max_bytes else ''
+    print(f'encoded {img.size[0]}x{img.size[1]} q{quality}: {size / 1024:.0f} KB'
+          f' in {(time.monotonic() - start) * 1e3:.0f} ms{budget}')
+    return output_path
+
+
+def _source_key(path):
+    st = os.stat(path)
+    return os.path.abspath(path), st.st_size, st.st_mtime_ns
+
+
+def _cached_trim_box(source_key):
+    with _cache_lock:
+        return _trim_boxes.get(source_key, _MISSING)
+
+
+def _remember_trim_box(source_key, box):
+    with _cache_lock:
+        _trim_boxes[source_key] = box
+        while len(_trim_boxes) > _TRIM_BOXES_MAX:
+            del _trim_boxes[next(iter(_trim_boxes))]
+    return box
+
+
+def _cached_tile(tile_key):
+    with _cache_lock:
+        tile = _tiles.get(tile_key)
+        if tile is not None:
+            _tiles.move_to_end(tile_key)
+        return tile
+
+
+def _remember_tile(tile_key, tile):
+    global _tiles_bytes
+    size = tile.size[0] * tile.size[1] * 3
+    if size > _TILE_CACHE_BYTES:
+        return
+    with _cache_lock:
+        if tile_key in _tiles:
+            return
+        _tiles[tile_key] = tile
+        _tiles_bytes += size
+        while _tiles_bytes > _TILE_CACHE_BYTES:
+            _, evicted = _tiles.popitem(last=False)
+            _tiles_bytes -= evicted.size[0] * evicted.size[1] * 3
+
+
+def _decode(img, height, box=None):
+    """Decode an opened image so that it, or its trim box, has at least `height` rows.
+
+    JPEGs are decoded in draft mode at the smallest DCT scale that still
+    covers that, so the resize that follows only ever scales down.
+    """
+    w, h = img.size
+    # Trimming crops before the resize, so the whole image must be taller by the crop's share
+    want_h = height / (box[3] - box[1]) if box is not None else height
+    want_h = min(h, math.ceil(want_h) + 1)  # +1 absorbs rounding of the crop edges
+    img.draft('RGB', (math.ceil(w * want_h / h), want_h))
+    return img.convert('RGB')
 
-    images = []
-    for path, trim in zip(paths, trim_flags):
-        img = Image.open(path).convert('RGB')
-        if trim:
-            img = _trim_whitespace(img)
-        images.append(img)
 
-    target_height = max(img.size[1] for img in images)
+def _relative_trim_box(img):
+    """Trim bbox as fractions of the image size, so it applies at any decode scale."""
+    bbox = _trim_bbox(img)
+    if bbox is None:
+        return None
+    w, h = img.size
+    left, top, right, bottom = bbox
+    return left / w, top / h, right / w, bottom / h
 
-    resized = []
-    for img in images:
+
+def _trimmed_size(size, box):
+    w, h = size
+    if box is None:
+        return w, h
+    left, top, right, bottom = box
+    return max(1, round((right - left) * w)), max(1, round((bottom - top) * h))
+
+
+def _make_tile(img, box, size, height):
+    if box is not None:
         w, h = img.size
-        new_w = round(w * target_height / h)
-        resized.append(img.resize((new_w, target_height), Image.LANCZOS))
+        left, top, right, bottom = box
+        img = img.crop((round(left * w), round(top * h), round(right * w), round(bottom * h)))
+    new_w = round(size[0] * height / size[1])
+    return img.resize((new_w, height), Image.LANCZOS)
+
+
+def _map(fn, items, workers):
+    """[fn(*item) for item in items], across a thread pool when workers > 1. Order is preserved."""
+    if not workers or workers < 2 or len(items) < 2:
+        return [fn(*item) for item in items]
+    with ThreadPoolExecutor(max_workers=min(workers, len(items))) as pool:
+        return list(pool.map(lambda item: fn(*item), items))
+
+
+def _resolve_trim_box(path, trim, source_key):
+    """Relative trim box of the image at path, or None if it isn't trimmed.
+
+    Found on a full-resolution decode (no draft), from a separate open of the
+    file, so the box doesn't depend on the output size and the caller's
+    image can still be draft-decoded for its tile.
+    """
+    if not trim:
+        return None
+    box = _cached_trim_box(source_key)
+    if box is not _MISSING:
+        return box
+    with Image.open(path) as img:
+        return _remember_trim_box(source_key, _relative_trim_box(img.convert('RGB')))
+
+
+def _tile(img, trim, source_key, box, size, height):
+    tile_key = (source_key, trim, height)
+    tile = _cached_tile(tile_key)
+    if tile is None:
+        tile = _make_tile(_decode(img, height, box), box, size, height)
+        _remember_tile(tile_key, tile)
+    return tile
+
+
+def _compose_streaming(paths, trim_flags, source_keys, max_height, max_width):
+    """Compose the output canvas holding at most one source and one tile besides it.
+
+    The first passes read headers and decode, one at a time, the sources whose
+    trim box isn't cached yet; the last decodes, resizes and pastes
+    each tile, then releases it. Tiles already in the cache are reused, but
+    new ones aren't added to it.
+    """
+    native_sizes = []
+    for path in paths:
+        with Image.open(path) as img:
+            native_sizes.append(img.size)
+    boxes = [_resolve_trim_box(path, trim, key) for path, trim, key in zip(paths, trim_flags, source_keys)]
+
+    sizes = [_trimmed_size(size, box) for size, box in zip(native_sizes, boxes)]
+    target_height = _target_height(sizes, max_height, max_width)
+    widths = [round(w * target_height / h) for w, h in sizes]
+    output_img = Image.new('RGB', (sum(widths), target_height), (250, 250, 250))
+
+    x = 0
+    for path, trim, source_key, box, size, width in zip(paths, trim_flags, source_keys, boxes, sizes, widths):
+        tile = _cached_tile((source_key, trim, target_height))
+        if tile is None:
+            with Image.open(path) as img:
+                tile = _make_tile(_decode(img, target_height, box), box, size, target_height)
+        output_img.paste(tile, (x, 0))
+        x += width
+        del tile
+    return output_img
 
-    total_width = sum(img.size[0] for img in resized)
+
+def _compose(paths, trim_flags, source_keys, max_height, max_width, workers):
+    sources = [Image.open(path) for path in paths]  # lazy: only headers are read here
+    try:
+        native_sizes = [img.size for img in sources]
+
+        # Trim boxes decide each tile's aspect, so resolve them before the common height
+        boxes = _map(_resolve_trim_box, list(zip(paths, trim_flags, source_keys)), workers)
+
+        sizes = [_trimmed_size(size, box) for size, box in zip(native_sizes, boxes)]
+        target_height = _target_height(sizes, max_height, max_width)
+
+        tiles = _map(_tile,
+                     [(img, trim, key, box, size, target_height)
+                      for img, trim, key, box, size in zip(sources, trim_flags, source_keys, boxes, sizes)],
+                     workers)
+    finally:
+        for img in sources:
+            img.close()
+
+    total_width = sum(tile.size[0] for tile in tiles)
     output_img = Image.new('RGB', (total_width, target_height), (250, 250, 250))
 
     x = 0
-    for img in resized:
-        output_img.paste(img, (x, 0))
-        x += img.size[0]
+    for tile in tiles:
+        output_img.paste(tile, (x, 0))
+        x += tile.size[0]
+    return output_img
 
-    output_img.save(output_path, 'JPEG')
-    return output_path
+
+def combine(paths, output_path, trim_flags=None, max_height=None, max_width=None, max_bytes=None,
+            workers=None, streaming=None):
+    """Tile images left-to-right at a common height and save as JPEG.
+
+    The common height is the tallest (trimmed) tile, capped at max_height and
+    at whatever height keeps the total width within max_width. Tiles are never
+    scaled above that, and JPEG tiles are decoded in draft mode at the smallest
+    DCT scale that still covers it, so a 1/4-scale decode replaces a full decode
+    plus a big LANCZOS downscale.
+
+    Finished tiles are kept in an in-process LRU keyed by (source file, size,
+    mtime, trim, height), along with each source's trim box, so composing
+    another selection of the same covers only decodes the new ones. A
+    re-downloaded cover has a new mtime and therefore misses the cache.
+
+    With workers > 1, tiles are decoded, trimmed and resized on that many
+    threads (Pillow releases the GIL for most of it). Each tile is still
+    computed from its own source alone, so the output is identical to the
+    serial path.
+
+    streaming=True composes one tile at a time instead, so peak memory is the
+    output canvas plus a single source rather than every source and tile at
+    once; it ignores workers and doesn't fill the tile cache. By default it's
+    used for selections of more than STREAMING_MIN_TILES papers.
+
+    max_bytes is the destination's size budget; see encode_jpeg().
+    """
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    if trim_flags is None:
+        trim_flags = [False] * len(paths)
+    if streaming is None:
+        streaming = len(paths) > STREAMING_MIN_TILES
+
+    source_keys = [_source_key(path) for path in paths]
+    if streaming:
+        output_img = _compose_streaming(paths, trim_flags, source_keys, max_height, max_width)
+    else:
+        output_img = _compose(paths, trim_flags, source_keys, max_height, max_width, workers)
+    return encode_jpeg(output_img, output_path, max_bytes)
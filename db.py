@@ -19,9 +19,28 @@ CREATE TABLE IF NOT EXISTS subscriptions (
     consecutive_errors INTEGER NOT NULL DEFAULT 0,
     active            INTEGER NOT NULL DEFAULT 1
 );
+
+-- One row per subscription per delivery date. deliver.py workers claim a
+-- pending job (or a running one whose lease has expired, i.e. its worker
+-- died) by taking a lease, then mark it done or hand it back as pending.
+CREATE TABLE IF NOT EXISTS delivery_jobs (
+    id               INTEGER PRIMARY KEY AUTOINCREMENT,
+    subscription_id  INTEGER NOT NULL REFERENCES subscriptions(id),
+    date             TEXT    NOT NULL,
+    state            TEXT    NOT NULL DEFAULT 'pending',  -- pending | running | done
+    attempts         INTEGER NOT NULL DEFAULT 0,
+    lease_owner      TEXT,
+    lease_expires_at TEXT,
+    last_error       TEXT,
+    updated_at       TEXT    NOT NULL,
+    UNIQUE (subscription_id, date)
+);
+CREATE INDEX IF NOT EXISTS delivery_jobs_date_state ON delivery_jobs (date, state);
 """
 
 AUTO_DEACTIVATE_THRESHOLD = 7
+JOB_LEASE_SECONDS = 10 * 60
+JOB_KEEP_DAYS = 30
 
 
 def _connect():
@@ -100,6 +119,119 @@ def record_error(sub_id, error_msg):
         )
 
 
+def enqueue_jobs(sub_ids, d):
+    """Add a pending delivery job for each subscription on date d, unless it already has one."""
+    now = datetime.datetime.utcnow().isoformat()
+    cutoff = (d - datetime.timedelta(days=JOB_KEEP_DAYS)).isoformat()
+    with _connect() as conn:
+        conn.executemany(
+            """INSERT OR IGNORE INTO delivery_jobs (subscription_id, date, updated_at)
+               VALUES (?, ?, ?)""",
+            [(sub_id, d.isoformat(), now) for sub_id in sub_ids],
+        )
+        conn.execute('DELETE FROM delivery_jobs WHERE date < ?', (cutoff,))
+
+
+def claim_job(d, owner, lease_seconds=JOB_LEASE_SECONDS, failed_before=None, sub_ids=None):
+    """Atomically lease the next deliverable job for date d to owner.
+
+    Takes a pending job, or a running one whose lease has expired, for a
+    subscription that is still active (and in sub_ids, if given). Jobs that
+    failed at or after failed_before (a UTC ISO timestamp, e.g. the start of
+    the current run) are skipped, so a run tries each job at most once.
+    Returns the job as a dict, or None if there is nothing left to claim.
+    BEGIN IMMEDIATE takes the write lock before the SELECT, so two workers
+    (in any process) never get the same job.
+    """
+    now = datetime.datetime.utcnow()
+    query = """SELECT j.* FROM delivery_jobs j JOIN subscriptions s ON s.id = j.subscription_id
+               WHERE j.date = ? AND s.active = 1
+                 AND (j.state = 'pending' OR (j.state = 'running' AND j.lease_expires_at < ?))
+                 AND NOT (j.state = 'pending' AND j.last_error IS NOT NULL AND j.updated_at >= ?)"""
+    params = [d.isoformat(), now.isoformat(), failed_before or '9999']
+    if sub_ids is not None:
+        sub_ids = list(sub_ids)
+        query += f" AND j.subscription_id IN ({', '.join('?' * len(sub_ids)) or 'NULL'})"
+        params += sub_ids
+    conn = _connect()
+    conn.isolation_level = None
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        row = conn.execute(query + ' ORDER BY j.id LIMIT 1', params).fetchone()
+        if row is None:
+            conn.execute('COMMIT')
+            return None
+        expires = (now + datetime.timedelta(seconds=lease_seconds)).isoformat()
+        conn.execute(
+            """UPDATE delivery_jobs
+               SET state = 'running', attempts = attempts + 1, lease_owner = ?,
+                   lease_expires_at = ?, updated_at = ?
+               WHERE id = ?""",
+            (owner, expires, now.isoformat(), row['id']),
+        )
+        conn.execute('COMMIT')
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
+    finally:
+        conn.close()
+    job = dict(row)
+    job.update(state='running', attempts=row['attempts'] + 1, lease_owner=owner, lease_expires_at=expires)
+    return job
+
+
+def get_jobs(d):
+    """Delivery jobs for date d as a dict keyed by subscription id."""
+    with _connect() as conn:
+        rows = conn.execute('SELECT * FROM delivery_jobs WHERE date = ?', (d.isoformat(),)).fetchall()
+    return {r['subscription_id']: dict(r) for r in rows}
+
+
+def renew_lease(job_id, owner, lease_seconds=JOB_LEASE_SECONDS):
+    """Push a running job's lease out to lease_seconds from now.
+
+    Returns False if owner no longer holds it (it expired and another worker
+    claimed the job).
+    """
+    now = datetime.datetime.utcnow()
+    expires = (now + datetime.timedelta(seconds=lease_seconds)).isoformat()
+    with _connect() as conn:
+        cur = conn.execute(
+            """UPDATE delivery_jobs
+               SET lease_expires_at = ?, updated_at = ?
+               WHERE id = ? AND lease_owner = ? AND state = 'running'""",
+            (expires, now.isoformat(), job_id, owner),
+        )
+        return cur.rowcount > 0
+
+
+def complete_job(job_id, owner):
+    """Mark a job delivered. Returns False if owner no longer held its lease."""
+    now = datetime.datetime.utcnow().isoformat()
+    with _connect() as conn:
+        cur = conn.execute(
+            """UPDATE delivery_jobs
+               SET state = 'done', lease_owner = NULL, lease_expires_at = NULL,
+                   last_error = NULL, updated_at = ?
+               WHERE id = ? AND lease_owner = ?""",
+            (now, job_id, owner),
+        )
+        return cur.rowcount > 0
+
+
+def fail_job(job_id, owner, error_msg):
+    """Hand a job back as pending for a later run, keeping the error."""
+    now = datetime.datetime.utcnow().isoformat()
+    with _connect() as conn:
+        conn.execute(
+            """UPDATE delivery_jobs
+               SET state = 'pending', lease_owner = NULL, lease_expires_at = NULL,
+                   last_error = ?, updated_at = ?
+               WHERE id = ? AND lease_owner = ?""",
+            (error_msg, now, job_id, owner),
+        )
+
+
 if __name__ == '__main__':
     init()
     print(f'Database initialized at {DB_PATH}')
@@ -8,30 +8,84 @@ On the final run of the day, pass --tolerate-miss: any papers that still fail
 are omitted from the combined image and an apology note is prepended to the
 Discord message. Earlier runs fail fast so the next hourly attempt can retry.
 
+Subscriptions are delivered concurrently (--workers, default 8), with a cap
+on sends in flight per destination host and Discord's per-webhook rate limits
+honored. The run ends by printing wall time and per-subscription latency.
+
+With --ready (or prefetch.py --daemon --deliver, which calls dispatch_ready()
+whenever a paper lands), a subscription is delivered as soon as all of its
+papers are cached. One still missing papers goes out without them
+TOLERATE_MISS_GRACE after its first paper landed (counting from no earlier
+than --window-start, since web visitors fetch covers from midnight on), or at
+--cutoff, whichever comes first:
+    */5 10-15 * * * /path/to/env/bin/python /path/to/deliver.py --ready >> /path/to/deliver.log 2>&1
+
+Each run queues a job per pending subscription in db.py's delivery_jobs table
+and its workers claim them under a lease. Overlapping runs (or several
+processes) therefore never deliver the same subscription twice, and a run
+that crashed mid-way is resumed by the next one once its leases expire.
+
+With COVERCOMPARE_BASE_URL set, Discord messages embed the combined image from
+the webapp's /covers/ URL rather than uploading a copy per webhook, falling
+back to uploading if that URL isn't being served.
+
 Crontab (final run at 16:00 UTC = 11 AM ET gets --tolerate-miss):
     0 12-15 * * * /path/to/env/bin/python /path/to/deliver.py >> /path/to/deliver.log 2>&1
     0 16    * * * /path/to/env/bin/python /path/to/deliver.py --tolerate-miss >> /path/to/deliver.log 2>&1
 """
 
 import argparse
+import contextlib
 import datetime
-import glob
 import json
 import os
+import socket
 import sys
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from zoneinfo import ZoneInfo
 
+import requests
 import yaml
 
+import cache
 import combine
 import db
 import discord
 import email_delivery
 import fetch
+import health
+import singleflight
 
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-DOWNLOADS_DIR = os.path.join(BASE_DIR, 'downloads')
-GENERATED_DIR = os.path.join(BASE_DIR, 'generated_images')
+_COMBINE_WORKERS = os.cpu_count() or 1
+
+# Subscriptions are delivered on a pool of _DELIVERY_WORKERS threads, with at
+# most _PER_HOST_LIMIT sends in flight to any one host (discord.com, the SMTP
+# relay), so one slow webhook no longer holds up everyone queued behind it.
+# For Discord the cap covers each HTTP request only, not a rate-limit wait.
+_DELIVERY_WORKERS = 8
+_PER_HOST_LIMIT = 4
+_host_slots = {}
+_host_slots_lock = threading.Lock()
+
+# With --ready / dispatch_ready(), how long a subscription waits for its
+# remaining papers once the first has landed before going out without them
+TOLERATE_MISS_GRACE = 2 * 60 * 60
+# ... and how long after a failed attempt before dispatch_ready() retries it,
+# so a webhook outage doesn't burn through AUTO_DEACTIVATE_THRESHOLD in minutes
+_RETRY_FAILED_AFTER = 30 * 60
+_ET = ZoneInfo('America/New_York')
+
+# Discord deliveries link to the combined image as published by the webapp at
+# COVERCOMPARE_BASE_URL/covers/<name> instead of uploading it to every
+# webhook. Each image's public URL is checked once per run; if it isn't being
+# served (no base URL set, webapp down), posts fall back to uploading.
+_published = {}
+_published_lock = threading.Lock()
 
 
 def _load_yaml():
@@ -39,34 +93,81 @@ def _load_yaml():
         return yaml.safe_load(f)
 
 
-def _cached_paper_path(papername, d):
-    pattern = os.path.join(DOWNLOADS_DIR, f'{d.isoformat()}-{papername}.*')
-    matches = glob.glob(pattern)
-    return matches[0] if matches else None
+def _host_slot(sub):
+    """Return the semaphore bounding concurrent sends to a subscription's destination host."""
+    if sub.get('subscription_type', 'discord') == 'email':
+        host = os.environ.get('SMTP_HOST', 'smtp')
+    else:
+        host = urllib.parse.urlsplit(sub['destination']).hostname or sub['destination']
+    with _host_slots_lock:
+        slot = _host_slots.get(host)
+        if slot is None:
+            slot = _host_slots[host] = threading.BoundedSemaphore(_PER_HOST_LIMIT)
+    return slot
+
+
+def _public_url(path):
+    """Public URL serving the combined image at path, or None if it isn't reachable."""
+    base_url = os.environ.get('COVERCOMPARE_BASE_URL')
+    if not base_url:
+        return None
+    with _published_lock:
+        if path in _published:
+            return _published[path]
+
+    def check():
+        url = f'{base_url.rstrip("/")}/covers/{os.path.basename(path)}'
+        try:
+            r = requests.head(url, timeout=discord.TIMEOUT, allow_redirects=True)
+            ok = r.status_code == 200 and r.headers.get('Content-Length') == str(os.path.getsize(path))
+        except requests.RequestException:
+            ok = False
+        if not ok:
+            print(f'{url} is not being served; uploading {os.path.basename(path)} instead', file=sys.stderr)
+        with _published_lock:
+            _published[path] = url if ok else None
+        return _published[path]
+
+    return singleflight.do(('publish', path), check)
 
 
-def _fetch_papers(sub_id, paper_keys, cfg, d):
+def _fetch_papers(sub_id, paper_keys, cfg, d, known_errors=None):
     """Fetch all papers, returning (paths, trim_flags, failed_keys).
 
     Never raises — per-paper failures are collected in failed_keys so the
-    caller can decide whether to abort or send a partial delivery.
+    caller can decide whether to abort or send a partial delivery. Papers in
+    known_errors already failed this run and aren't retried.
     """
+    found = {}
+    errors = {}
+    misses = []
+    for key in paper_keys:
+        if key not in cfg['papers']:
+            errors[key] = KeyError(key)
+            continue
+        if known_errors and key in known_errors:
+            errors[key] = known_errors[key]
+            continue
+        cached = cache.lookup(key, d)
+        if cached:
+            found[key] = cached
+        else:
+            print(f'[sub {sub_id}/{key}] cache miss, fetching...')
+            misses.append(key)
+
+    fetched, fetch_errors = fetch.fetch_many(cfg, misses, d)
+    found.update(fetched)
+    errors.update(fetch_errors)
+
     paths = []
     trim_flags = []
     failed = []
     for key in paper_keys:
-        try:
-            paper_cfg = cfg['papers'][key]
-            cached = _cached_paper_path(key, d)
-            if cached:
-                path = cached
-            else:
-                print(f'[sub {sub_id}/{key}] cache miss, fetching...')
-                path = fetch.fetch_paper(paper_cfg, key, d)
-            paths.append(path)
-            trim_flags.append(paper_cfg.get('trim_whitespace', False))
-        except Exception as e:
-            print(f'[sub {sub_id}/{key}] fetch failed: {e}', file=sys.stderr)
+        if key in found:
+            paths.append(found[key])
+            trim_flags.append(cfg['papers'][key].get('trim_whitespace', False))
+        else:
+            print(f'[sub {sub_id}/{key}] fetch failed: {errors[key]}', file=sys.stderr)
             failed.append(key)
     return paths, trim_flags, failed
 
@@ -79,53 +180,60 @@ def _already_delivered(sub, today):
     return last.startswith(today.isoformat())
 
 
-def deliver_subscription(sub, cfg, today, tolerate_miss=False):
+def deliver_subscription(sub, cfg, today, tolerate_miss=False, known_errors=None):
+    """Deliver one subscription, recording the outcome on it. Returns an error message, or None on success."""
     sub_id = sub['id']
     papers = json.loads(sub['papers'])
 
     print(f'[sub {sub_id}] delivering {papers}')
 
-    combined_path = os.path.join(GENERATED_DIR, f'{today.isoformat()}-sub{sub_id}.jpg')
-    os.makedirs(GENERATED_DIR, exist_ok=True)
-
-    paths, trim_flags, failed = _fetch_papers(sub_id, papers, cfg, today)
+    paths, trim_flags, failed = _fetch_papers(sub_id, papers, cfg, today, known_errors)
 
     if failed and not tolerate_miss:
         error_msg = f"fetch failed for: {', '.join(failed)}"
         db.record_error(sub_id, error_msg)
         print(f'[sub {sub_id}] FAILED (fetch): {error_msg}', file=sys.stderr)
-        return
+        return error_msg
 
     if not paths:
         error_msg = f"all papers failed to fetch: {', '.join(failed)}"
         db.record_error(sub_id, error_msg)
         print(f'[sub {sub_id}] FAILED (fetch): {error_msg}', file=sys.stderr)
-        return
+        return error_msg
 
     missing_names = [cfg['papers'][k]['name'] if k in cfg['papers'] else k for k in failed]
 
     try:
-        combine.combine(paths, combined_path, trim_flags)
+        # Content-addressed, so subscriptions with the same papers share one render
+        present = [k for k in papers if k not in failed]
         sub_type = sub.get('subscription_type', 'discord')
+        max_bytes = email_delivery.MAX_IMAGE_BYTES if sub_type == 'email' else discord.MAX_UPLOAD_BYTES
+        combined_path = cache.combined(present, today, paths, trim_flags, missing=failed,
+                                       max_height=combine.DELIVERY_MAX_HEIGHT,
+                                       max_width=combine.DELIVERY_MAX_WIDTH, max_bytes=max_bytes,
+                                       workers=_COMBINE_WORKERS)
         if sub_type == 'email':
             extra_note = (
                 f"⚠️ Sorry! Couldn't fetch: {', '.join(missing_names)}\n\n"
                 if missing_names else ""
             )
-            email_delivery.send(
-                combined_path, today,
-                to_email=sub['destination'],
-                label=sub['label'] or None,
-                sub_id=sub_id,
-                extra_note=extra_note,
-            )
+            with _host_slot(sub):
+                email_delivery.send(
+                    combined_path, today,
+                    to_email=sub['destination'],
+                    label=sub['label'] or None,
+                    sub_id=sub_id,
+                    extra_note=extra_note,
+                )
             print(f'[sub {sub_id}] OK (email)')
         else:
             extra_text = (
                 f"⚠️ Sorry! Couldn't fetch: {', '.join(missing_names)}\n\n"
                 if missing_names else ""
             )
-            resp = discord.post(combined_path, today, extra_text=extra_text, webhook_url=sub['destination'], username=sub['label'] or None)
+            resp = discord.post(combined_path, today, extra_text=extra_text, webhook_url=sub['destination'],
+                                username=sub['label'] or None, image_url=_public_url(combined_path),
+                                slot=_host_slot(sub))
             if not (200 <= resp.status_code < 300):
                 raise RuntimeError(f'Discord returned HTTP {resp.status_code}: {resp.text[:200]}')
             print(f'[sub {sub_id}] OK (HTTP {resp.status_code})')
@@ -134,27 +242,186 @@ def deliver_subscription(sub, cfg, today, tolerate_miss=False):
         error_msg = str(e)
         db.record_error(sub_id, error_msg)
         print(f'[sub {sub_id}] FAILED (post): {error_msg}', file=sys.stderr)
+        return error_msg
+    return None
+
+
+@contextlib.contextmanager
+def _lease_held(job_id, owner):
+    """Renew a job's lease every third of JOB_LEASE_SECONDS while the block runs.
+
+    A delivery can outlast one lease: tolerate-miss papers are refetched
+    under the per-paper lock, and Discord may ask us to wait out a rate limit.
+    """
+    stop = threading.Event()
+
+    def renew():
+        while not stop.wait(db.JOB_LEASE_SECONDS / 3):
+            if not db.renew_lease(job_id, owner):
+                print(f'[job {job_id}] lease lost to another worker; delivery may be repeated', file=sys.stderr)
+                return
+
+    renewer = threading.Thread(target=renew, daemon=True)
+    renewer.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        renewer.join()
+
+
+def _work(owner, cfg, today, tolerate_miss, known_errors, latencies, run_started, sub_ids):
+    """Claim and deliver today's jobs for sub_ids until none are left, trying each once."""
+    while True:
+        job = db.claim_job(today, owner, failed_before=run_started, sub_ids=sub_ids)
+        if job is None:
+            return
+        sub = db.get_subscription(job['subscription_id'])
+        start = time.monotonic()
+        try:
+            with _lease_held(job['id'], owner):
+                error_msg = deliver_subscription(sub, cfg, today, tolerate_miss=tolerate_miss,
+                                                 known_errors=known_errors)
+        except Exception as e:
+            error_msg = str(e)
+            print(f'[sub {sub["id"]}] FAILED: {error_msg}', file=sys.stderr)
+        latencies.append(time.monotonic() - start)
+        if error_msg is None:
+            if not db.complete_job(job['id'], owner):
+                print(f'[sub {sub["id"]}] delivered, but job {job["id"]} had already been reclaimed by another'
+                      f' worker; it may be delivered twice', file=sys.stderr)
+        else:
+            db.fail_job(job['id'], owner, error_msg)
+
+
+def deliver_all(subs, cfg, today, tolerate_miss=False, workers=_DELIVERY_WORKERS):
+    """Deliver subs on a pool of `workers` threads and print timing stats.
+
+    Each sub gets a job for today in db.py's delivery_jobs table, and workers
+    claim only those jobs. Runs in other processes share the queue without
+    double-delivering, and a job left half-done by a crashed run is taken
+    over once its lease expires. A job that fails is handed back for a later
+    run rather than retried in this one. Every paper the subs need is fetched
+    once up front, so concurrent subscriptions sharing a paper don't each
+    fetch it.
+    """
+    start = time.monotonic()
+    run_started = datetime.datetime.utcnow().isoformat()
+    sub_ids = [sub['id'] for sub in subs]
+    db.enqueue_jobs(sub_ids, today)
+    wanted = dict.fromkeys(k for sub in subs for k in json.loads(sub['papers']) if k in cfg['papers'])
+    _, known_errors = fetch.fetch_many(cfg, [k for k in wanted if not cache.lookup(k, today)], today)
+
+    latencies = []
+    owner = f'{socket.gethostname()}:{os.getpid()}'
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = [pool.submit(_work, f'{owner}:{i}', cfg, today, tolerate_miss, known_errors, latencies,
+                               run_started, sub_ids)
+                   for i in range(max(1, workers))]
+        for future in futures:
+            future.result()
+    email_delivery.close_pool()
+
+    if latencies:
+        print(f'{len(latencies)} subscription(s) in {time.monotonic() - start:.1f}s wall time; per subscription'
+              f' p50={health._percentile(latencies, 50):.1f}s p95={health._percentile(latencies, 95):.1f}s'
+              f' max={max(latencies):.1f}s')
+
+
+def _partial_after(sub_papers, cfg, today, window_start):
+    """Time (epoch seconds) after which a subscription may go out without its missing papers.
+
+    TOLERATE_MISS_GRACE after the first of its papers landed in the cache
+    today or after window_start, whichever is later; None if none has landed.
+    A cover a visitor pulled in at 00:30 doesn't start anyone's wait.
+    """
+    rows = [cache.entry(k, today) for k in sub_papers if k in cfg['papers']]
+    fetched = [row['fetched_at'] for row in rows if row]
+    if not fetched:
+        return None
+    first = datetime.datetime.fromisoformat(min(fetched)).replace(tzinfo=datetime.timezone.utc)
+    return max(first.timestamp(), window_start) + TOLERATE_MISS_GRACE
+
+
+def dispatch_ready(cfg, today, window_start, cutoff=None, workers=_DELIVERY_WORKERS):
+    """Deliver every pending subscription whose papers are all cached for today.
+
+    A subscription still missing papers goes out without them (tolerate-miss)
+    once TOLERATE_MISS_GRACE has passed since the first of its papers landed
+    or since `window_start` (epoch seconds, the start of the delivery window),
+    whichever is later, or once `cutoff` (epoch seconds) has passed. The rest wait for a later
+    call, as do subscriptions whose last attempt failed within
+    _RETRY_FAILED_AFTER. Cheap when nothing is ready, so it can be called
+    whenever the cache gains a paper. Returns the number of subscriptions
+    dispatched.
+    """
+    now = time.time()
+    retry_from = (datetime.datetime.utcnow() - datetime.timedelta(seconds=_RETRY_FAILED_AFTER)).isoformat()
+    jobs = db.get_jobs(today)
+    ready = []
+    partial = []
+    for sub in db.get_active_subscriptions():
+        if _already_delivered(sub, today):
+            continue
+        job = jobs.get(sub['id'])
+        if job and job['last_error'] and job['updated_at'] > retry_from:
+            continue
+        papers = json.loads(sub['papers'])
+        if all(cache.lookup(k, today) for k in papers if k in cfg['papers']):
+            ready.append(sub)
+            continue
+        partial_after = _partial_after(papers, cfg, today, window_start)
+        if (cutoff is not None and now >= cutoff) or (partial_after is not None and now >= partial_after):
+            partial.append(sub)
+
+    if ready:
+        print(f'{len(ready)} subscription(s) have all their papers; delivering')
+        deliver_all(ready, cfg, today, workers=workers)
+    if partial:
+        print(f'{len(partial)} subscription(s) past their wait for missing papers; delivering without them')
+        deliver_all(partial, cfg, today, tolerate_miss=True, workers=workers)
+    return len(ready) + len(partial)
 
 
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('--tolerate-miss', action='store_true',
                         help='Send partial delivery if some papers fail (use on final daily run)')
+    parser.add_argument('--workers', type=int, default=_DELIVERY_WORKERS,
+                        help='Subscriptions delivered concurrently (1 = one at a time)')
+    parser.add_argument('--ready', action='store_true',
+                        help='Only deliver subscriptions whose papers are all cached, or whose wait for '
+                             'missing papers has run out (see --cutoff)')
+    parser.add_argument('--window-start', default='05:30',
+                        help='ET time (HH:MM) the delivery window opens; with --ready, the wait for '
+                             'missing papers never starts earlier')
+    parser.add_argument('--cutoff', default='11:00',
+                        help='ET time (HH:MM) after which --ready sends everyone, minus missing papers')
     args = parser.parse_args()
+    if args.ready and args.tolerate_miss:
+        parser.error('--ready already sends partial deliveries once their wait runs out; '
+                     'use --tolerate-miss on its own for a final catch-all run')
 
     today = datetime.date.today()
     print(f'deliver.py starting — {today.isoformat()} (tolerate_miss={args.tolerate_miss})')
 
     db.init()
     cfg = _load_yaml()
+    if args.ready:
+        window_start = datetime.datetime.combine(today, datetime.time.fromisoformat(args.window_start), tzinfo=_ET)
+        cutoff = datetime.datetime.combine(today, datetime.time.fromisoformat(args.cutoff), tzinfo=_ET)
+        dispatched = dispatch_ready(cfg, today, window_start.timestamp(), cutoff=cutoff.timestamp(),
+                                    workers=args.workers)
+        print(f'deliver.py done — {dispatched} dispatched')
+        return
+
     subs = db.get_active_subscriptions()
     print(f'{len(subs)} active subscription(s)')
 
     pending = [s for s in subs if not _already_delivered(s, today)]
     print(f'{len(pending)} pending, {len(subs) - len(pending)} already delivered today')
 
-    for sub in pending:
-        deliver_subscription(sub, cfg, today, tolerate_miss=args.tolerate_miss)
+    deliver_all(pending, cfg, today, tolerate_miss=args.tolerate_miss, workers=args.workers)
 
     print('deliver.py done')
 
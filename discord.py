@@ -1,26 +1,107 @@
+import contextlib
 import datetime
 import json
 import os
+import threading
+import time
+
 import requests
 
-def post(path, current_date, extra_text="", webhook_url=None, username=None):
+# Webhook attachment limit for servers without boosts
+MAX_UPLOAD_BYTES = 8 * 1024 * 1024
+
+TIMEOUT = (5, 60)
+
+# Discord rate-limits each webhook separately. After a 429 (or a response
+# saying the bucket is empty) further posts to that webhook wait until it
+# resets; posts to other webhooks carry on.
+_RATE_LIMIT_RETRIES = 3
+_MAX_RETRY_AFTER = 60
+_blocked_until = {}
+_blocked_lock = threading.Lock()
+
+
+def _wait_for(webhook_url):
+    with _blocked_lock:
+        delay = _blocked_until.get(webhook_url, 0) - time.time()
+    if delay > 0:
+        time.sleep(delay)
+
+
+def _note_rate_limit(webhook_url, response):
+    """Record when webhook_url may next be posted to. Returns the wait in seconds."""
+    delay = 0
+    if response.status_code == 429:
+        try:
+            delay = float(response.headers.get('Retry-After') or response.json()['retry_after'])
+        except (ValueError, KeyError, TypeError):
+            delay = 1
+    elif response.headers.get('X-RateLimit-Remaining') == '0':
+        try:
+            delay = float(response.headers.get('X-RateLimit-Reset-After', 0))
+        except ValueError:
+            delay = 0
+    if delay > 0:
+        with _blocked_lock:
+            _blocked_until[webhook_url] = max(_blocked_until.get(webhook_url, 0), time.time() + delay)
+    return delay
+
+
+def _post(webhook_url, slot, **kwargs):
+    """POST to a webhook, waiting out and retrying its rate limits.
+
+    slot, if given, is held around each HTTP request only, never while
+    waiting on this webhook's rate limit, so other webhooks can use it.
+    """
+    files = kwargs.get('files')
+    for attempt in range(_RATE_LIMIT_RETRIES + 1):
+        _wait_for(webhook_url)
+        if files:
+            files['file'][1].seek(0)
+        with slot or contextlib.nullcontext():
+            response = requests.post(webhook_url, timeout=TIMEOUT, **kwargs)
+        delay = _note_rate_limit(webhook_url, response)
+        if response.status_code != 429 or attempt == _RATE_LIMIT_RETRIES or delay > _MAX_RETRY_AFTER:
+            return response
+        print(f'Discord rate limit on webhook, retrying in {delay:.1f}s')
+
+
+def post(path, current_date, extra_text="", webhook_url=None, username=None, image_url=None, slot=None):
+    """Post the image at path to a webhook.
+
+    With image_url (a public copy of the same image), the message just embeds
+    that URL, so nothing is uploaded. If Discord rejects it or the request
+    fails, the image is uploaded as an attachment as usual.
+
+    slot is an optional semaphore (e.g. a per-host concurrency cap) held only
+    while a request is in flight.
+    """
 
     if webhook_url is None:
         webhook_url = os.environ.get('COVERCOMPARE_DISCORD_WEBHOOK')
 
     formatted_date = current_date.strftime("%A, %B %d %Y")
 
+    msg = {"content": extra_text + formatted_date}
+    if username:
+        msg["username"] = username
+
+    if image_url:
+        try:
+            response = _post(webhook_url, slot, json=dict(msg, embeds=[{"image": {"url": image_url}}]))
+            if 200 <= response.status_code < 300:
+                return response
+            print(f'Discord rejected linked image (HTTP {response.status_code}), uploading instead')
+        except requests.RequestException as e:
+            print(f'Posting linked image failed ({e}), uploading instead')
+
+    payload = {
+        "payload_json": json.dumps(dict(msg, embeds=[{"image": {"url": "attachment://image.jpg"}}]))
+    }
+
     # Open the image file in binary mode
     with open(path, "rb") as f:
         files = {
             "file": ("image.jpg", f)
         }
-        msg = {"content": extra_text + formatted_date,
-               "embeds": [{"image": {"url": "attachment://image.jpg"}}]}
-        if username:
-            msg["username"] = username
-        payload = {
-            "payload_json": json.dumps(msg)
-        }
-        response = requests.post(webhook_url, data=payload, files=files)
-        return response
\ No newline at end of file
+        return _post(webhook_url, slot, data=payload, files=files)
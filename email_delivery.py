@@ -6,28 +6,144 @@ Required environment variables:
     SMTP_PASSWORD     — SMTP API key / password
     SMTP_FROM_EMAIL   — verified sender address
     SMTP_PORT         — optional, defaults to 587
+    SMTP_STARTTLS     — optional, set to 0 to skip STARTTLS (e.g. a local test server)
     SMTP_FROM_NAME    — optional sender display name, defaults to 'CoverCompare'
     COVERCOMPARE_BASE_URL — base URL for unsubscribe links, e.g. https://covercompare.io
+
+SMTP_USER/SMTP_PASSWORD may be left unset for a server that needs no login.
+
+Connections are pooled: send() checks out an idle authenticated session (or
+opens one), sends, and checks it back in, so a delivery run pays the
+connect/EHLO/STARTTLS/login handshake once per pooled connection rather than
+once per subscriber. A session the server has dropped is replaced and the
+message resent once. A rejected recipient only fails that send; the session
+is reset and reused.
 """
 
+import atexit
 import os
 import smtplib
+import threading
+import time
 from email.mime.image import MIMEImage
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 
+# Budget for the inline image. Base64 grows it by a third, and many providers
+# cap whole messages at 10 MB.
+MAX_IMAGE_BYTES = 4 * 1024 * 1024
+
+
+TIMEOUT = 30
+
+# Idle sessions kept for reuse; most relays drop a connection idle for a
+# minute or so, so older ones are closed rather than tried.
+_POOL_SIZE = 4
+_MAX_IDLE = 45
+_idle = []  # (smtp, config key, last used)
+_pool_lock = threading.Lock()
+
 
 def _smtp_config():
     return {
         'host': os.environ['SMTP_HOST'],
         'port': int(os.environ.get('SMTP_PORT', '587')),
-        'user': os.environ['SMTP_USER'],
-        'password': os.environ['SMTP_PASSWORD'],
+        'starttls': os.environ.get('SMTP_STARTTLS', '1') != '0',
+        'user': os.environ.get('SMTP_USER'),
+        'password': os.environ.get('SMTP_PASSWORD'),
         'from_email': os.environ['SMTP_FROM_EMAIL'],
         'from_name': os.environ.get('SMTP_FROM_NAME', 'CoverCompare'),
     }
 
 
+def _config_key(cfg):
+    return cfg['host'], cfg['port'], cfg['starttls'], cfg['user']
+
+
+def _quit(smtp):
+    try:
+        smtp.quit()
+    except (smtplib.SMTPException, OSError):
+        smtp.close()
+
+
+def _connect(cfg):
+    smtp = smtplib.SMTP(cfg['host'], cfg['port'], timeout=TIMEOUT)
+    try:
+        smtp.ehlo()
+        if cfg['starttls']:
+            smtp.starttls()
+            smtp.ehlo()
+        if cfg['user']:
+            smtp.login(cfg['user'], cfg['password'])
+    except BaseException:
+        smtp.close()
+        raise
+    return smtp
+
+
+def _checkout(cfg):
+    key = _config_key(cfg)
+    stale = []
+    smtp = None
+    with _pool_lock:
+        now = time.monotonic()
+        while _idle:
+            candidate, candidate_key, last_used = _idle.pop()
+            if candidate_key == key and now - last_used < _MAX_IDLE:
+                smtp = candidate
+                break
+            stale.append(candidate)
+    for old in stale:
+        _quit(old)
+    return smtp or _connect(cfg)
+
+
+def _checkin(cfg, smtp):
+    with _pool_lock:
+        if len(_idle) < _POOL_SIZE:
+            _idle.append((smtp, _config_key(cfg), time.monotonic()))
+            return
+    _quit(smtp)
+
+
+def close_pool():
+    """Close every idle pooled session."""
+    with _pool_lock:
+        sessions = [smtp for smtp, _, _ in _idle]
+        _idle.clear()
+    for smtp in sessions:
+        _quit(smtp)
+
+
+atexit.register(close_pool)
+
+
+def _sendmail(cfg, to_email, message):
+    """Send one message on a pooled session, replacing the session once if the server dropped it."""
+    smtp = _checkout(cfg)
+    try:
+        try:
+            smtp.sendmail(cfg['from_email'], to_email, message)
+        except smtplib.SMTPServerDisconnected:
+            smtp.close()
+            smtp = _connect(cfg)
+            smtp.sendmail(cfg['from_email'], to_email, message)
+    except (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError):
+        # The server refused this message, but the session is still good
+        try:
+            smtp.rset()
+        except (smtplib.SMTPException, OSError):
+            smtp.close()
+            raise
+        _checkin(cfg, smtp)
+        raise
+    except BaseException:
+        smtp.close()
+        raise
+    _checkin(cfg, smtp)
+
+
 def _format_date(d):
     """Format date as 'Friday, February 28 2026'."""
     return d.strftime('%A, %B %-d %Y')
@@ -101,8 +217,4 @@ def send(path, date, to_email, label, sub_id, extra_note=''):
     img.add_header('Content-Disposition', 'inline', filename='covers.jpg')
     msg.attach(img)
 
-    with smtplib.SMTP(cfg['host'], cfg['port']) as smtp:
-        smtp.ehlo()
-        smtp.starttls()
-        smtp.login(cfg['user'], cfg['password'])
-        smtp.sendmail(cfg['from_email'], to_email, msg.as_string())
+    _sendmail(cfg, to_email, msg.as_string())
@@ -1,35 +1,211 @@
 import base64
 import datetime
 import email.utils  # parsedate_to_datetime is stdlib's de facto HTTP date parser
-import io
 import os
 import re
+import tempfile
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+
 import requests
 from PIL import Image, ImageOps
 from zoneinfo import ZoneInfo
 
+import cache
+import health
+import jsonstore
+import sessions
+import singleflight
+
 
 _DOWNLOADS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'downloads')
 
+# fetch_many runs papers on a bounded pool; each upstream host additionally gets
+# at most _PER_HOST_LIMIT in-flight fetches so we stay polite to e.g. frontpages.com,
+# which serves a third of the papers.
+_MAX_WORKERS = 8
+_PER_HOST_LIMIT = 2
+_SOURCE_HOSTS = {
+    'frontpages': 'www.frontpages.com',
+    'freedomforum': 'cdn.freedomforum.org',
+    'kiosko': 'www.kiosko.net',
+    'nypost_scrape': 'nypost.com',
+    'pressreader': 't.prcdn.co',
+    'pagesuite': 'pagesuite',
+}
+_host_slots = {}
+_host_slots_lock = threading.Lock()
+
+_MAX_IMAGE_BYTES = 25 * 1024 * 1024
+_CHUNK_SIZE = 64 * 1024
+_IMAGE_MAGIC = (b'\xff\xd8\xff', b'\x89PNG\r\n\x1a\n', b'GIF87a', b'GIF89a')
+
+# Image URLs scraped from HTML pages, cached per source/ident/requested date
+_RESOLVED_PATH = os.path.join(_DOWNLOADS_DIR, '.resolved_urls.json')
+_PROVISIONAL_TTL = 300
+_RESOLVED_KEEP_DAYS = 7
+
+_FRONTPAGES_DATE_RE = re.compile(r'"dateModified"\s*:\s*"(\d{4}-\d{2}-\d{2})')
+_FRONTPAGES_PATH_RE = re.compile(r"atob\('([A-Za-z0-9+/=]+)'\)")
+_FRONTPAGES_MIRROR_RES = (
+    re.compile(r'id="giornale-img"[^>]*class="[^"]*rttx'),
+    re.compile(r'class="[^"]*rttx[^"]*"[^>]*id="giornale-img"'),
+)
+_KIOSKO_DATE_RE = re.compile(r'img\.kiosko\.net/(\d{4}/\d{2}/\d{2})')
+_NYPOST_P1_RE = re.compile(r'https://nypost\.com/wp-content/uploads/sites/2/\d{4}/\d{2}/\w+\.P1[^\s"\'<]+\.jpg')
+_PAGESUITE_EDID_RE = re.compile(r'[?&]edid=([a-f0-9-]+)')
+
+# Set per worker thread by _hedged_fetch; _stream_to_file aborts once it fires.
+_cancel = threading.local()
+
+
+class _Cancelled(Exception):
+    """A hedged fetch lost the race and stopped downloading."""
+
+
+def _check_cancelled():
+    event = getattr(_cancel, 'event', None)
+    if event is not None and event.is_set():
+        raise _Cancelled()
+
+
+def _looks_like_image(head):
+    return head.startswith(_IMAGE_MAGIC) or (head[:4] == b'RIFF' and head[8:12] == b'WEBP')
+
+
+def _stream_to_file(response, path, mirror=False):
+    """Stream an image response to path without ever exposing a partial file.
+
+    The body is written in chunks to a hidden temp file in downloads/, capped
+    at _MAX_IMAGE_BYTES and checked for image magic bytes, then renamed over
+    path, so concurrent readers only ever see whole covers.
+    """
+    try:
+        content_type = response.headers.get('Content-Type', '')
+        if content_type.startswith(('text/', 'application/json')):
+            raise RuntimeError(f'Expected an image from {response.url}, got {content_type}')
+        if int(response.headers.get('Content-Length') or 0) > _MAX_IMAGE_BYTES:
+            raise RuntimeError(f'Image at {response.url} exceeds {_MAX_IMAGE_BYTES} bytes')
+
+        fd, tmp_path = tempfile.mkstemp(dir=_DOWNLOADS_DIR, prefix='.partial-')
+        try:
+            size = 0
+            head = b''
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in response.iter_content(_CHUNK_SIZE):
+                    size += len(chunk)
+                    if size > _MAX_IMAGE_BYTES:
+                        raise RuntimeError(f'Image at {response.url} exceeds {_MAX_IMAGE_BYTES} bytes')
+                    if len(head) < 12:
+                        head += chunk[:12 - len(head)]
+                    f.write(chunk)
+                    _check_cancelled()
+            if not _looks_like_image(head):
+                raise RuntimeError(f'Body from {response.url} is not a JPEG/PNG/GIF/WebP image')
+            if mirror:
+                with Image.open(tmp_path) as img:
+                    fmt = img.format
+                    mirrored = ImageOps.mirror(img)
+                mirrored.save(tmp_path, format=fmt)
+            _check_cancelled()
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+    finally:
+        # Hand the connection back to the pooled session even when rejected unread
+        response.close()
+
 
 def _save_image(url, papername, date=None, mirror=False):
     os.makedirs(_DOWNLOADS_DIR, exist_ok=True)
-    image_res = requests.get(url, headers={
-        'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36'
-    })
-    image_res.raise_for_status()
     ext = os.path.splitext(url.split('?')[0])[1]
     if ext.lower() not in ('.jpg', '.jpeg', '.png', '.webp', '.gif'):
         ext = '.jpg'
     if date is None:
         date = datetime.date.today()
     path = os.path.join(_DOWNLOADS_DIR, f'{date.isoformat()}-{papername}{ext}')
-    if mirror:
-        img = Image.open(io.BytesIO(image_res.content))
-        ImageOps.mirror(img).save(path)
-    else:
-        with open(path, 'wb') as f:
-            f.write(image_res.content)
+    # Re-polling an unchanged edition costs a 304 rather than the full image
+    image_res, cached_path = sessions.conditional_get(url, stream=True)
+    if cached_path:
+        return cached_path
+    image_res.raise_for_status()
+    _stream_to_file(image_res, path, mirror=mirror)
+    cache.record(papername, date, path)
+    sessions.remember(url, image_res, path)
+    return path
+
+
+def _resolution_key(source, ident, d):
+    return f'{source}:{ident}:{d.isoformat()}'
+
+
+def _cached_resolution(source, ident, d):
+    """Return a cached (image_url, actual_date, mirror) for source/ident/date, or None."""
+    hit = jsonstore.read(_RESOLVED_PATH).get(_resolution_key(source, ident, d))
+    if hit is None or (hit['expires'] is not None and hit['expires'] < time.time()):
+        return None
+    actual_date = datetime.date.fromisoformat(hit['date']) if hit['date'] else None
+    return hit['url'], actual_date, hit['mirror']
+
+
+def _remember_resolution(source, ident, d, url, actual_date, mirror):
+    """Cache a resolution. One that landed on the requested edition is final;
+    one that found an older edition is kept only briefly, since the page will
+    switch over once the new edition is published."""
+    final = actual_date == d
+    cutoff = (d - datetime.timedelta(days=_RESOLVED_KEEP_DAYS)).isoformat()
+
+    def mutate(entries):
+        entries[_resolution_key(source, ident, d)] = {
+            'requested': d.isoformat(),
+            'url': url,
+            'date': actual_date.isoformat() if actual_date else None,
+            'mirror': mirror,
+            'expires': None if final else time.time() + _PROVISIONAL_TTL,
+        }
+        for key in [k for k, e in entries.items() if e['requested'] < cutoff]:
+            del entries[key]
+
+    jsonstore.update(_RESOLVED_PATH, mutate)
+
+
+def _forget_resolution(source, ident, d):
+    jsonstore.update(_RESOLVED_PATH, lambda entries: entries.pop(_resolution_key(source, ident, d), None))
+
+
+def _save_resolved(url, papername, d, actual_date, mirror):
+    return _save_image(url, papername, date=actual_date, mirror=mirror), actual_date
+
+
+def _fetch_resolved(source, ident, papername, d, resolve, save=_save_resolved, fresh=False):
+    """Download the image an HTML-scraped source points at.
+
+    resolve() scrapes the source's page and returns (image_url, actual_date,
+    mirror); the result is cached per source/ident/date so revalidating or
+    re-downloading the image skips the page round-trip. save() downloads it
+    and returns (path, actual_date). A cached URL that no longer downloads is
+    forgotten and resolved afresh. With fresh (the caller has just seen d's
+    edition on the page), a cached resolution to an older edition is ignored.
+    """
+    d = d or datetime.date.today()
+    cached = _cached_resolution(source, ident, d)
+    if cached and fresh and cached[1] is not None and cached[1] < d:
+        cached = None
+    if cached:
+        url, actual_date, mirror = cached
+        try:
+            return save(url, papername, d, actual_date, mirror)[0]
+        except _Cancelled:
+            raise
+        except Exception as e:
+            print(f'[{papername}] cached {source} image URL failed ({e}), re-resolving')
+            _forget_resolution(source, ident, d)
+    url, actual_date, mirror = resolve()
+    path, actual_date = save(url, papername, d, actual_date, mirror)
+    if actual_date is not None:
+        _remember_resolution(source, ident, d, url, actual_date, mirror)
     return path
 
 
@@ -41,13 +217,24 @@ def _parse_frontpages_date(html):
     matches the edition date for US papers published that morning.
     Returns a datetime.date, or None if not found.
     """
-    m = re.search(r'"dateModified"\s*:\s*"(\d{4}-\d{2}-\d{2})', html)
+    m = _FRONTPAGES_DATE_RE.search(html)
     if m:
         return datetime.date.fromisoformat(m.group(1))
     return None
 
 
-def _fetch_frontpages(slug, papername, d):
+def _resolve_frontpages(slug, d):
+    r = sessions.get(f'https://www.frontpages.com/{slug}/')
+    actual_date = _parse_frontpages_date(r.text) or d
+    m = _FRONTPAGES_PATH_RE.search(r.text)
+    if not m:
+        raise RuntimeError(f'Could not find image path in frontpages page for {slug}')
+    full_url = 'https://www.frontpages.com' + base64.b64decode(m.group(1)).decode('utf-8')
+    needs_mirror = any(pattern.search(r.text) for pattern in _FRONTPAGES_MIRROR_RES)
+    return full_url, actual_date, needs_mirror
+
+
+def _fetch_frontpages(slug, papername, d, fresh=False):
     """Fetch full-res cover from frontpages.com for any paper by its URL slug.
 
     frontpages.com base64-encodes the full-size image path in an obfuscated
@@ -60,16 +247,8 @@ def _fetch_frontpages(slug, papername, d):
     Find a paper's slug at https://www.frontpages.com/<slug>/
     e.g. 'daily-news', 'new-york-post', 'newsday'
     """
-    r = requests.get(f'https://www.frontpages.com/{slug}/', headers={
-        'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36'
-    })
-    actual_date = _parse_frontpages_date(r.text) or (d or datetime.date.today())
-    m = re.search(r"atob\('([A-Za-z0-9+/=]+)'\)", r.text)
-    path = base64.b64decode(m.group(1)).decode('utf-8')
-    full_url = 'https://www.frontpages.com' + path
-    needs_mirror = bool(re.search(r'id="giornale-img"[^>]*class="[^"]*rttx', r.text) or
-                        re.search(r'class="[^"]*rttx[^"]*"[^>]*id="giornale-img"', r.text))
-    return _save_image(full_url, papername, date=actual_date, mirror=needs_mirror)
+    d = d or datetime.date.today()
+    return _fetch_resolved('frontpages', slug, papername, d, lambda: _resolve_frontpages(slug, d), fresh=fresh)
 
 
 def _fetch_freedomforum(code, papername, d):
@@ -86,7 +265,17 @@ def _fetch_freedomforum(code, papername, d):
     return _save_image(url, papername, date=d)
 
 
-def _fetch_kiosko(slug, papername, d, region='us'):
+def _resolve_kiosko(slug, region):
+    r = sessions.get(f'https://www.kiosko.net/{region}/np/{slug}.html')
+    m = _KIOSKO_DATE_RE.search(r.text)
+    if not m:
+        raise RuntimeError(f'Could not find date in kiosko page for {slug}')
+    date_path = m.group(1)
+    actual_date = datetime.date.fromisoformat(date_path.replace('/', '-'))
+    return f'https://img.kiosko.net/{date_path}/{region}/{slug}.750.jpg', actual_date, False
+
+
+def _fetch_kiosko(slug, papername, d, region='us', fresh=False):
     """Fetch cover from kiosko.net by paper slug (750px JPEG).
 
     Scrapes the date from the page rather than using d directly, since some
@@ -96,16 +285,18 @@ def _fetch_kiosko(slug, papername, d, region='us'):
     Find a paper's slug at https://www.kiosko.net/{region}/ — URL is /{region}/np/{slug}.html
     e.g. 'wsj', 'nyt', 'usatoday' (region='us'), 'vocero' (region='pr')
     """
-    r = requests.get(f'https://www.kiosko.net/{region}/np/{slug}.html', headers={
-        'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36'
-    })
-    m = re.search(r'img\.kiosko\.net/(\d{4}/\d{2}/\d{2})', r.text)
+    return _fetch_resolved('kiosko', f'{region}/{slug}', papername, d, lambda: _resolve_kiosko(slug, region),
+                           fresh=fresh)
+
+
+def _resolve_nypost(d):
+    date_str = d.strftime('%B-%d-%Y').lower().replace('-0', '-')
+    r = sessions.get(f'https://nypost.com/cover/{date_str}/')
+    r.raise_for_status()
+    m = _NYPOST_P1_RE.search(r.text)
     if not m:
-        raise RuntimeError(f'Could not find date in kiosko page for {slug}')
-    date_path = m.group(1)
-    actual_date = datetime.date.fromisoformat(date_path.replace('/', '-'))
-    url = f'https://img.kiosko.net/{date_path}/{region}/{slug}.750.jpg'
-    return _save_image(url, papername, date=actual_date)
+        raise RuntimeError(f'Could not find P1 image URL in NY Post cover page for {date_str}')
+    return m.group(0), d, False
 
 
 def _fetch_nypost_scrape(papername, d):
@@ -116,15 +307,7 @@ def _fetch_nypost_scrape(papername, d):
     Supports historical dates since the archive goes back years.
     """
     d = d or datetime.date.today()
-    date_str = d.strftime('%B-%d-%Y').lower().replace('-0', '-')
-    r = requests.get(f'https://nypost.com/cover/{date_str}/', headers={
-        'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36'
-    })
-    r.raise_for_status()
-    m = re.search(r'https://nypost\.com/wp-content/uploads/sites/2/\d{4}/\d{2}/\w+\.P1[^\s"\'<]+\.jpg', r.text)
-    if not m:
-        raise RuntimeError(f'Could not find P1 image URL in NY Post cover page for {date_str}')
-    return _save_image(m.group(0), papername, date=d)
+    return _fetch_resolved('nypost_scrape', 'cover', papername, d, lambda: _resolve_nypost(d))
 
 
 # Newsday CloudFront CDN — was the primary source until ~Mar 2026 when it started returning 403.
@@ -134,7 +317,42 @@ def _fetch_nypost_scrape(papername, d):
 #     return _save_image(f'https://d2dr22b2lm4tvw.cloudfront.net/ny_nd/{d.isoformat()}/front-page-large.jpg', papername, date=d)
 
 
-def _fetch_pagesuite(pbid, papername, d, redirect_url=None):
+def _resolve_pagesuite_redirect(redirect_url):
+    redir = sessions.get(redirect_url)
+    m = _PAGESUITE_EDID_RE.search(redir.url)
+    if not m:
+        raise RuntimeError(f'Could not find edid in redirect URL: {redir.url}')
+    eid = m.group(1)
+    return f'https://edition.pagesuite.com/get_image.aspx?w=1200&eid={eid}&pnum=1', None, False
+
+
+def _last_modified_date(response):
+    last_mod = response.headers.get('Last-Modified')
+    if not last_mod:
+        return None
+    return email.utils.parsedate_to_datetime(last_mod).astimezone(ZoneInfo('America/New_York')).date()
+
+
+def _save_pagesuite(url, papername, d, actual_date=None, mirror=False):
+    """Download a PageSuite page image, dated by its Last-Modified header.
+
+    Returns (path, edition_date); edition_date is None on a 304, where the
+    previously saved file is reused as-is.
+    """
+    r, cached_path = sessions.conditional_get(url, stream=True)
+    if cached_path:
+        return cached_path, None
+    r.raise_for_status()
+    actual_date = _last_modified_date(r) or d
+    os.makedirs(_DOWNLOADS_DIR, exist_ok=True)
+    path = os.path.join(_DOWNLOADS_DIR, f'{actual_date.isoformat()}-{papername}.jpg')
+    _stream_to_file(r, path)
+    cache.record(papername, actual_date, path)
+    sessions.remember(url, r, path)
+    return path, actual_date
+
+
+def _fetch_pagesuite(pbid, papername, d, redirect_url=None, fresh=False):
     """Fetch front page from PageSuite e-edition service by publication ID.
 
     Always returns today's edition — no historical date support.
@@ -151,30 +369,11 @@ def _fetch_pagesuite(pbid, papername, d, redirect_url=None):
     """
     d = d or datetime.date.today()
     if redirect_url:
-        redir = requests.get(redirect_url, headers={
-            'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36'
-        })
-        m = re.search(r'[?&]edid=([a-f0-9-]+)', redir.url)
-        if not m:
-            raise RuntimeError(f'Could not find edid in redirect URL: {redir.url}')
-        eid = m.group(1)
-        url = f'https://edition.pagesuite.com/get_image.aspx?w=1200&eid={eid}&pnum=1'
-    else:
-        url = f'https://edition.pagesuite-professional.co.uk/get_image.aspx?w=1200&pbid={pbid}'
-    r = requests.get(url, headers={
-        'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36'
-    })
-    r.raise_for_status()
-    last_mod = r.headers.get('Last-Modified')
-    if last_mod:
-        actual_date = email.utils.parsedate_to_datetime(last_mod).astimezone(ZoneInfo('America/New_York')).date()
-    else:
-        actual_date = d
-    os.makedirs(_DOWNLOADS_DIR, exist_ok=True)
-    path = os.path.join(_DOWNLOADS_DIR, f'{actual_date.isoformat()}-{papername}.jpg')
-    with open(path, 'wb') as f:
-        f.write(r.content)
-    return path
+        return _fetch_resolved('pagesuite', redirect_url, papername, d,
+                               lambda: _resolve_pagesuite_redirect(redirect_url), save=_save_pagesuite,
+                               fresh=fresh)
+    url = f'https://edition.pagesuite-professional.co.uk/get_image.aspx?w=1200&pbid={pbid}'
+    return _save_pagesuite(url, papername, d)[0]
 
 
 def _fetch_pressreader(cid, papername, d, issue_suffix='00000000001001'):
@@ -197,40 +396,256 @@ def _fetch_pressreader(cid, papername, d, issue_suffix='00000000001001'):
     return _save_image(url, papername, date=d)
 
 
-def _fetch_source(source_cfg, papername, d):
-    """Dispatch a single source config entry to the appropriate fetcher."""
+def _fetch_source(source_cfg, papername, d, fresh=False):
+    """Dispatch a single source config entry to the appropriate fetcher.
+
+    fresh means the source is known to carry d's edition, so scraped sources
+    skip any cached resolution to an older one.
+    """
     source = source_cfg['source']
     if source == 'frontpages':
-        return _fetch_frontpages(source_cfg['slug'], papername, d)
+        return _fetch_frontpages(source_cfg['slug'], papername, d, fresh=fresh)
     elif source == 'freedomforum':
         return _fetch_freedomforum(source_cfg['code'], papername, d)
     elif source == 'kiosko':
-        return _fetch_kiosko(source_cfg['slug'], papername, d, region=source_cfg.get('region', 'us'))
+        return _fetch_kiosko(source_cfg['slug'], papername, d, region=source_cfg.get('region', 'us'), fresh=fresh)
     elif source == 'nypost_scrape':
         return _fetch_nypost_scrape(papername, d)
     elif source == 'pressreader':
         return _fetch_pressreader(source_cfg['cid'], papername, d, issue_suffix=source_cfg.get('issue_suffix', '00000000001001'))
     elif source == 'pagesuite':
-        return _fetch_pagesuite(source_cfg.get('pbid'), papername, d, redirect_url=source_cfg.get('redirect_url'))
+        return _fetch_pagesuite(source_cfg.get('pbid'), papername, d, redirect_url=source_cfg.get('redirect_url'),
+                                fresh=fresh)
     else:
         raise ValueError(f'Unknown source: {source}')
 
 
-def fetch_paper(cfg, papername, d):
-    """Try each source in order, returning the first success.
+def _host_slot(source):
+    """Return the semaphore bounding concurrent fetches against a source's host."""
+    host = _SOURCE_HOSTS.get(source, source)
+    with _host_slots_lock:
+        slot = _host_slots.get(host)
+        if slot is None:
+            slot = _host_slots[host] = threading.BoundedSemaphore(_PER_HOST_LIMIT)
+    return slot
 
-    Raises RuntimeError only if all sources fail.
+
+# Sources that address an issue by its date, so a 404 just means that
+# edition hasn't been published yet
+_DATE_ADDRESSED_SOURCES = {'nypost_scrape', 'pressreader'}
+
+
+def _edition_missing(source, error):
+    return (source in _DATE_ADDRESSED_SOURCES and isinstance(error, requests.HTTPError)
+            and error.response is not None and error.response.status_code == 404)
+
+
+def _try_source(source_cfg, papername, d, fresh=False):
+    """Fetch from one source under its host's concurrency limit, recording its health."""
+    source = source_cfg['source']
+    with _host_slot(source):
+        start = time.monotonic()
+        try:
+            path = _fetch_source(source_cfg, papername, d, fresh=fresh)
+        except _Cancelled:
+            raise
+        except Exception as e:
+            health.record(papername, source, False, time.monotonic() - start, error=e,
+                          missing=_edition_missing(source, e))
+            raise
+    health.record(papername, source, True, time.monotonic() - start)
+    return path
+
+
+# Sources whose image is known to be the requested (or a correctly dated)
+# edition: frontpages/kiosko read the date off the page, PageSuite uses
+# Last-Modified, and nypost_scrape/pressreader address the issue by date.
+# freedomforum's jpg{day} URL only encodes the day of the month, so it may
+# serve a weeks-old cover.
+_DATED_SOURCES = {'frontpages', 'kiosko', 'pagesuite', 'nypost_scrape', 'pressreader'}
+
+
+def _hedged_fetch(sources, papername, d, hedge_after, first_source=None):
+    """Race a paper's sources, starting the next one whenever we've waited
+    hedge_after seconds without a result (or the running ones all failed).
+
+    The first source to return an image wins; the others are told to stop via
+    _cancel and abandon their temp files before they reach downloads/. A
+    source outside _DATED_SOURCES is never raced: it only starts once every
+    source before it has failed, so it can't beat a slow but correct one with
+    a stale cover.
     """
+    cancel = threading.Event()
     errors = []
+    remaining = list(sources)
+    pending = {}
+
+    def attempt(source_cfg):
+        _cancel.event = cancel
+        try:
+            return _try_source(source_cfg, papername, d, fresh=source_cfg is first_source)
+        finally:
+            _cancel.event = None
+
+    pool = ThreadPoolExecutor(max_workers=len(sources))
+    try:
+        source_cfg = remaining.pop(0)
+        pending[pool.submit(attempt, source_cfg)] = source_cfg
+        while pending:
+            can_hedge = bool(remaining) and remaining[0]['source'] in _DATED_SOURCES
+            done, _ = wait(pending, timeout=hedge_after if can_hedge else None, return_when=FIRST_COMPLETED)
+            for future in done:
+                source_cfg = pending.pop(future)
+                try:
+                    path = future.result()
+                except Exception as e:
+                    print(f'[{papername}] {source_cfg["source"]} failed: {e}, trying next source')
+                    errors.append(f'{source_cfg["source"]}: {e}')
+                else:
+                    cancel.set()
+                    return path
+            if remaining and (can_hedge or not pending):
+                if not done:
+                    print(f'[{papername}] no answer after {hedge_after}s, hedging with {remaining[0]["source"]}')
+                source_cfg = remaining.pop(0)
+                pending[pool.submit(attempt, source_cfg)] = source_cfg
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+    raise RuntimeError(f'All sources failed for {papername}: {"; ".join(errors)}')
+
+
+def _check_source(source_cfg, d):
+    """Cheaply check whether a source already carries the edition for d.
+
+    Returns True/False, or None when the source has no cheap check (or the
+    check itself is inconclusive) and the only way to know is to fetch.
+    """
+    source = source_cfg['source']
+    if source == 'pagesuite':
+        if source_cfg.get('redirect_url'):
+            url = _resolve_pagesuite_redirect(source_cfg['redirect_url'])[0]
+        else:
+            url = f'https://edition.pagesuite-professional.co.uk/get_image.aspx?w=1200&pbid={source_cfg["pbid"]}'
+        r = sessions.head(url)
+        edition = _last_modified_date(r) if r.ok else None
+        return None if edition is None else edition >= d
+    elif source == 'frontpages':
+        r = sessions.get(f'https://www.frontpages.com/{source_cfg["slug"]}/')
+        edition = _parse_frontpages_date(r.text) if r.ok else None
+        return None if edition is None else edition >= d
+    elif source == 'kiosko':
+        edition = _resolve_kiosko(source_cfg['slug'], source_cfg.get('region', 'us'))[1]
+        return edition >= d
+    elif source == 'nypost_scrape':
+        date_str = d.strftime('%B-%d-%Y').lower().replace('-0', '-')
+        r = sessions.get(f'https://nypost.com/cover/{date_str}/')
+        return r.ok and bool(_NYPOST_P1_RE.search(r.text))
+    elif source == 'pressreader':
+        issue = f'{source_cfg["cid"]}{d.strftime("%Y%m%d")}{source_cfg.get("issue_suffix", "00000000001001")}'
+        return sessions.head(f'https://t.prcdn.co/img?file={issue}&page=1&scale=200').ok
+    # freedomforum reuses one URL per day-of-month, so nothing cheap tells
+    # this month's cover apart from last month's
+    return None
+
+
+def edition_available(cfg, papername, d):
+    """Return the first of a paper's source configs that has the edition for d.
+
+    False if every source's cheap check says not yet (or failed), None if it
+    can't be told without fetching. Sources on a failure cooldown are checked
+    too: a check is cheap, and the source that's been failing may be the
+    first to carry today's edition. Pass the returned source to fetch_paper
+    as first_source so the fetch goes where the edition was seen.
+    """
+    unknown = False
     for source_cfg in cfg['sources']:
         try:
-            return _fetch_source(source_cfg, papername, d)
+            available = _check_source(source_cfg, d)
+        except Exception as e:
+            print(f'[{papername}] {source_cfg["source"]} availability check failed: {e}')
+            available = False
+        if available:
+            return source_cfg
+        unknown = unknown or available is None
+    return None if unknown else False
+
+
+def _fetch_sources(cfg, papername, d, hedge_after, first_source):
+    sources = health.order_sources(papername, cfg['sources'])
+    if first_source is not None:
+        sources = [first_source] + [s for s in sources if s != first_source]
+    if hedge_after is not None and len(sources) > 1:
+        return _hedged_fetch(sources, papername, d, hedge_after, first_source)
+
+    errors = []
+    for source_cfg in sources:
+        try:
+            return _try_source(source_cfg, papername, d, fresh=source_cfg is first_source)
         except Exception as e:
             print(f'[{papername}] {source_cfg["source"]} failed: {e}, trying next source')
             errors.append(f'{source_cfg["source"]}: {e}')
     raise RuntimeError(f'All sources failed for {papername}: {"; ".join(errors)}')
 
 
+def fetch_paper(cfg, papername, d, hedge_after=None, first_source=None):
+    """Try each source in order, returning the first success.
+
+    The order comes from health.order_sources: YAML order, minus sources on a
+    failure cooldown, with mostly-failing sources moved to the back.
+
+    With hedge_after (seconds), a slow source doesn't hold up the rest: the
+    next source starts in parallel once the budget runs out and the first
+    valid image wins. Used for interactive requests where tail latency matters.
+
+    first_source (one of cfg['sources'], e.g. from edition_available) is tried
+    before the rest regardless of its health, bypassing any short-lived cached
+    resolution that still points at an older edition.
+
+    Only one fetch per (paper, date) runs at a time across every process: the
+    webapp, prefetch.py, deliver.py and post_today.py all serialize on a
+    per-paper lock file, and whoever waited returns the cover the holder just
+    cached instead of downloading it again.
+
+    Raises RuntimeError only if all sources fail.
+    """
+    def fetch_if_missing():
+        return cache.lookup(papername, d) or _fetch_sources(cfg, papername, d, hedge_after, first_source)
+
+    lock_path = os.path.join(_DOWNLOADS_DIR, '.locks', f'{papername}.lock')
+    return singleflight.do(('paper', papername, d), fetch_if_missing, lock_path=lock_path)
+
+
+def fetch_many(cfg, keys, d, max_workers=_MAX_WORKERS, first_sources=None):
+    """Fetch several papers concurrently.
+
+    cfg is the full papers.yaml dict. Papers run on a bounded thread pool, and
+    fetch_paper's per-host limits keep any one site from being hammered, so a
+    full warm-up takes about as long as the slowest paper. first_sources maps
+    paper keys to the source fetch_paper should try first.
+
+    Returns (paths, errors): dicts keyed by paper key holding the saved path or
+    the exception raised for that paper. Never raises for a single paper.
+    """
+    keys = list(dict.fromkeys(keys))
+    paths = {}
+    errors = {}
+    if not keys:
+        return paths, errors
+
+    def fetch_one(key):
+        return fetch_paper(cfg['papers'][key], key, d, first_source=(first_sources or {}).get(key))
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(keys))) as pool:
+        futures = {pool.submit(fetch_one, key): key for key in keys}
+        for future in as_completed(futures):
+            key = futures[future]
+            try:
+                paths[key] = future.result()
+            except Exception as e:
+                errors[key] = e
+    return paths, errors
+
+
 if __name__ == '__main__':
     d = datetime.date.today()
     _fetch_nypost_scrape('nypost', d)
@@ -0,0 +1,122 @@
+"""health.py — persisted per-(paper, source) fetch health.
+
+fetch_paper records every source attempt here (outcome, latency, last error)
+and asks order_sources() which order to try a paper's sources in. YAML order
+still encodes preference (e.g. nypost_scrape's full-size P1 over the
+frontpages fallback), so sources are only demoted when they are mostly
+failing, and skipped entirely while on a failure cooldown.
+
+Run directly to print the current table:
+    python health.py
+"""
+
+import os
+import time
+
+import jsonstore
+
+
+_HEALTH_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'downloads', '.source_health.json')
+
+_WINDOW = 20              # recent outcomes / latencies kept per source
+_COOLDOWN_AFTER = 2       # consecutive failures before a source is benched
+_COOLDOWN_BASE = 15 * 60  # seconds; doubles with each further failure
+_COOLDOWN_MAX = 3600      # the daemon polls for hours; never bench a source past that
+_DEMOTE_BELOW = 0.5       # success rate under which a source moves to the back
+
+
+def _key(papername, source):
+    return f'{papername}/{source}'
+
+
+def _percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def record(papername, source, ok, latency, error=None, missing=False):
+    """Record one fetch attempt of papername from source.
+
+    missing marks a failure that only means the edition isn't out yet: it is
+    kept as the last error but counts neither against the success rate nor
+    toward a cooldown, since polling before publication is expected.
+    """
+    now = time.time()
+
+    def mutate(records):
+        rec = records.setdefault(_key(papername, source), {
+            'outcomes': '',
+            'latencies': [],
+            'consecutive_failures': 0,
+            'last_failure': None,
+            'cooldown_until': 0,
+        })
+        if missing:
+            rec['last_failure'] = {'at': now, 'error': str(error)[:200]}
+            return
+        rec['outcomes'] = (rec['outcomes'] + ('1' if ok else '0'))[-_WINDOW:]
+        if ok:
+            rec['latencies'] = (rec['latencies'] + [round(latency, 3)])[-_WINDOW:]
+            rec['consecutive_failures'] = 0
+            rec['cooldown_until'] = 0
+        else:
+            rec['consecutive_failures'] += 1
+            rec['last_failure'] = {'at': now, 'error': str(error)[:200]}
+            extra = rec['consecutive_failures'] - _COOLDOWN_AFTER
+            if extra >= 0:
+                rec['cooldown_until'] = now + min(_COOLDOWN_BASE * 2 ** extra, _COOLDOWN_MAX)
+
+    jsonstore.update(_HEALTH_PATH, mutate)
+
+
+def stats(papername, source, records=None):
+    """Return a summary dict for one (paper, source), or None if never tried."""
+    if records is None:
+        records = jsonstore.read(_HEALTH_PATH)
+    rec = records.get(_key(papername, source))
+    if rec is None:
+        return None
+    outcomes = rec['outcomes']
+    return {
+        'success_rate': outcomes.count('1') / len(outcomes) if outcomes else None,
+        'p50': _percentile(rec['latencies'], 50),
+        'p95': _percentile(rec['latencies'], 95),
+        'last_failure': rec['last_failure'],
+        'cooling_down': rec['cooldown_until'] > time.time(),
+    }
+
+
+def order_sources(papername, sources):
+    """Return sources in the order fetch_paper should try them.
+
+    Sources on cooldown are dropped unless every source is cooling down, in
+    which case all are returned so a paper is never given up without a try.
+    Mostly-failing sources go to the back; otherwise YAML order is kept.
+    """
+    records = jsonstore.read(_HEALTH_PATH)
+    summaries = [stats(papername, s['source'], records) or {} for s in sources]
+
+    available = [i for i, st in enumerate(summaries) if not st.get('cooling_down')]
+    indexes = available or list(range(len(sources)))
+
+    def demoted(i):
+        rate = summaries[i].get('success_rate')
+        return rate is not None and rate < _DEMOTE_BELOW
+
+    return [sources[i] for i in sorted(indexes, key=lambda i: (demoted(i), i))]
+
+
+if __name__ == '__main__':
+    records = jsonstore.read(_HEALTH_PATH)
+    for key in sorted(records):
+        papername, source = key.split('/', 1)
+        st = stats(papername, source, records)
+        rate = f'{st["success_rate"]:.0%}' if st['success_rate'] is not None else '-'
+        p50 = f'{st["p50"]:.2f}s' if st['p50'] is not None else '-'
+        p95 = f'{st["p95"]:.2f}s' if st['p95'] is not None else '-'
+        flag = ' COOLDOWN' if st['cooling_down'] else ''
+        print(f'{key:45} ok={rate:>4}  p50={p50:>7}  p95={p95:>7}{flag}')
+        if st['last_failure']:
+            print(f'{"":45} last failure: {st["last_failure"]["error"]}')
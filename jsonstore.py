@@ -0,0 +1,59 @@
+"""jsonstore.py — small JSON state files shared by the webapp and cron scripts.
+
+Writes go to a temp file that is renamed into place, so readers never see a
+half-written store. update() holds a threading lock plus an flock on a sidecar
+.lock file, so prefetch, deliver and the webapp can safely update the same
+store at the same time.
+"""
+
+import fcntl
+import json
+import os
+import tempfile
+import threading
+
+
+_locks = {}
+_locks_guard = threading.Lock()
+
+
+def _thread_lock(path):
+    with _locks_guard:
+        lock = _locks.get(path)
+        if lock is None:
+            lock = _locks[path] = threading.Lock()
+    return lock
+
+
+def read(path):
+    """Return the store's contents, or {} if it is missing or unreadable."""
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write(path, data):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def update(path, mutate):
+    """Apply mutate(data) to the store in place and persist it.
+
+    Returns whatever mutate returns.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with _thread_lock(path), open(path + '.lock', 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        data = read(path)
+        result = mutate(data)
+        _write(path, data)
+    return result
@@ -30,14 +30,14 @@ if __name__ == '__main__':
         paper_keys = config['default']
         run_label = 'combined'
 
-    paths = []
-    trim_flags = []
-    for key in paper_keys:
-        paper_cfg = config['papers'][key]
-        path = fetch.fetch_paper(paper_cfg, key, dt)
-        paths.append(path)
-        trim_flags.append(paper_cfg.get('trim_whitespace', False))
-
-    combined = combine.combine(paths, f'./generated_images/{dt.isoformat()}-{run_label}.jpg', trim_flags)
+    fetched, errors = fetch.fetch_many(config, paper_keys, dt)
+    if errors:
+        raise RuntimeError('; '.join(f'{key}: {e}' for key, e in errors.items()))
+    paths = [fetched[key] for key in paper_keys]
+    trim_flags = [config['papers'][key].get('trim_whitespace', False) for key in paper_keys]
+
+    combined = combine.combine(paths, f'./generated_images/{dt.isoformat()}-{run_label}.jpg', trim_flags,
+                               max_height=combine.DELIVERY_MAX_HEIGHT, max_width=combine.DELIVERY_MAX_WIDTH,
+                               max_bytes=discord.MAX_UPLOAD_BYTES)
     status = discord.post(combined, dt)
     print(status.text)
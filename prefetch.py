@@ -4,20 +4,42 @@ Run before deliver.py so webhook deliveries are instant cache hits.
 
 Crontab (11:30 UTC = 6:30 AM ET):
     30 11 * * * /path/to/env/bin/python /path/to/prefetch.py >> /path/to/prefetch.log 2>&1
+
+With --daemon it instead keeps running and polls each paper that doesn't have
+today's edition yet, using cheap checks (HEAD/Last-Modified on PageSuite,
+dateModified on frontpages, ...) before fetching. Each paper backs off
+exponentially from --interval up to 15 minutes, so a cover published at 6:35
+lands minutes later. It exits once every paper has today's edition, or at
+--until (ET):
+    30 10 * * * /path/to/env/bin/python /path/to/prefetch.py --daemon >> /path/to/prefetch.log 2>&1
+
+Every run also prunes old combined images from generated_images/ (see
+cache.prune_generated).
+
+Adding --deliver also delivers each subscription the moment all its papers
+are cached (see deliver.dispatch_ready), instead of at the next deliver.py run.
 """
 
+import argparse
 import datetime
-import glob
 import os
 import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from zoneinfo import ZoneInfo
 
 import yaml
 
+import cache
+import db
+import deliver
 import fetch
 
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-DOWNLOADS_DIR = os.path.join(BASE_DIR, 'downloads')
+_ET = ZoneInfo('America/New_York')
+_CHECK_WORKERS = 8
+_MAX_INTERVAL = 15 * 60
 
 
 def _load_yaml():
@@ -25,34 +47,128 @@ def _load_yaml():
         return yaml.safe_load(f)
 
 
-def _cached_paper_path(papername, d):
-    pattern = os.path.join(DOWNLOADS_DIR, f'{d.isoformat()}-{papername}.*')
-    matches = glob.glob(pattern)
-    return matches[0] if matches else None
+def _build_derivatives(cfg, key, path):
+    """Pre-build the files the webapp serves for a cover, so requests never do image work."""
+    if cfg['papers'][key].get('trim_whitespace'):
+        path = cache.trimmed(path)
+    cache.build_variants(path)
+
+
+def run_daemon(cfg, today, until, interval, deliver_ready=False):
+    """Poll every paper lacking today's edition until it lands or `until` passes.
+
+    With deliver_ready, subscriptions are handed to deliver.dispatch_ready()
+    after each round of checks, so each goes out as soon as its own papers
+    are in (and, at `until`, everyone still waiting goes out without theirs).
+    The delivery window opens when the daemon starts: a subscription's wait
+    for missing papers never counts from earlier than that.
+
+    Returns True if every paper ended up with today's edition.
+    """
+    window_start = time.time()
+    if deliver_ready:
+        deliver.dispatch_ready(cfg, today, window_start, cutoff=until)
+    now = time.time()
+    # key -> (next check time, delay to apply after that check)
+    schedule = {key: (now, interval) for key in cfg['papers'] if not cache.lookup(key, today)}
+    print(f'{len(schedule)} paper(s) waiting for today\'s edition')
+
+    def check(key):
+        return fetch.edition_available(cfg['papers'][key], key, today)
+
+    while schedule:
+        now = time.time()
+        if now >= until:
+            print(f'Giving up for today; still missing: {", ".join(sorted(schedule))}', file=sys.stderr)
+            if deliver_ready:
+                deliver.dispatch_ready(cfg, today, window_start, cutoff=until)
+            return False
+
+        due = [key for key, (next_check, _) in schedule.items() if next_check <= now]
+        if due:
+            with ThreadPoolExecutor(max_workers=_CHECK_WORKERS) as pool:
+                available = dict(zip(due, pool.map(check, due)))
+            # A source config means that source has today's edition, so it's fetched first;
+            # False means every source said "not yet"; None means we can only find out by fetching
+            first_sources = {key: source for key, source in available.items() if source}
+            paths, errors = fetch.fetch_many(cfg, [key for key in due if available[key] is not False], today,
+                                             first_sources=first_sources)
+            for key in due:
+                cached = cache.lookup(key, today)
+                if cached:
+                    print(f'[{key}] today\'s edition fetched -> {cached}')
+                    _build_derivatives(cfg, key, cached)
+                    del schedule[key]
+                    continue
+                if key in errors:
+                    print(f'[{key}] FAILED: {errors[key]}', file=sys.stderr)
+                elif key in paths:
+                    print(f'[{key}] only an older edition so far ({paths[key]})')
+                else:
+                    print(f'[{key}] not published yet')
+                delay = schedule[key][1]
+                schedule[key] = (now + delay, min(delay * 2, _MAX_INTERVAL))
+            if deliver_ready:
+                deliver.dispatch_ready(cfg, today, window_start, cutoff=until)
+
+        if schedule:
+            wake = min(min(next_check for next_check, _ in schedule.values()), until)
+            time.sleep(max(0, wake - time.time()))
+
+    print('All papers have today\'s edition')
+    return True
 
 
 def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--daemon', action='store_true',
+                        help='Keep polling until every paper has today\'s edition')
+    parser.add_argument('--until', default='11:00',
+                        help='ET time (HH:MM) at which --daemon gives up for the day')
+    parser.add_argument('--interval', type=int, default=120,
+                        help='Initial seconds between checks of a paper in --daemon mode')
+    parser.add_argument('--deliver', action='store_true',
+                        help='In --daemon mode, deliver each subscription as soon as its papers are in')
+    args = parser.parse_args()
+
     today = datetime.date.today()
     print(f'prefetch.py starting — {today.isoformat()}')
 
     cfg = _load_yaml()
+    deleted, freed = cache.prune_generated()
+    if deleted:
+        print(f'Pruned {deleted} old combined image(s), {freed / 1024 ** 2:.0f} MB')
+    if args.daemon:
+        until = datetime.datetime.combine(today, datetime.time.fromisoformat(args.until), tzinfo=_ET)
+        if args.deliver:
+            db.init()
+        run_daemon(cfg, today, until.timestamp(), args.interval, deliver_ready=args.deliver)
+        print('prefetch.py done')
+        return
+
     papers = cfg['papers']
     ok = 0
     skipped = 0
     failed = 0
 
-    for key, paper_cfg in papers.items():
-        cached = _cached_paper_path(key, today)
+    pending = []
+    for key in papers:
+        cached = cache.lookup(key, today)
         if cached:
             print(f'[{key}] cached ({cached})')
+            _build_derivatives(cfg, key, cached)
             skipped += 1
-            continue
-        try:
-            path = fetch.fetch_paper(paper_cfg, key, today)
-            print(f'[{key}] fetched -> {path}')
+        else:
+            pending.append(key)
+
+    paths, errors = fetch.fetch_many(cfg, pending, today)
+    for key in pending:
+        if key in paths:
+            print(f'[{key}] fetched -> {paths[key]}')
+            _build_derivatives(cfg, key, paths[key])
             ok += 1
-        except Exception as e:
-            print(f'[{key}] FAILED: {e}', file=sys.stderr)
+        else:
+            print(f'[{key}] FAILED: {errors[key]}', file=sys.stderr)
             failed += 1
 
     print(f'prefetch.py done — {ok} fetched, {skipped} skipped, {failed} failed')
@@ -0,0 +1,115 @@
+"""sessions.py — pooled HTTP sessions for every fetch source.
+
+One requests.Session per host keeps connections alive across the page and
+image hops of a fetch, and across papers that share a host. Idempotent
+requests are retried with backoff on connection errors and 5xx responses.
+
+conditional_get() adds ETag / If-Modified-Since revalidation: the validators
+from the last download of each URL are kept in downloads/.http_cache.json, and
+a 304 hands back the previously saved file instead of re-downloading it.
+"""
+
+import os
+import threading
+import time
+import urllib.parse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import jsonstore
+
+
+USER_AGENT = 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36'
+TIMEOUT = (5, 30)  # (connect, read) seconds
+
+_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'downloads', '.http_cache.json')
+_MAX_VALIDATORS = 500
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def _new_session():
+    retry = Retry(
+        total=2,
+        backoff_factor=0.5,
+        status_forcelist=(500, 502, 503, 504),
+        allowed_methods=frozenset({'GET', 'HEAD'}),
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=8, max_retries=retry)
+    session = requests.Session()
+    session.headers['User-Agent'] = USER_AGENT
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def session_for(url):
+    """Return the shared session for url's host, creating it on first use."""
+    host = urllib.parse.urlsplit(url).netloc
+    with _sessions_lock:
+        session = _sessions.get(host)
+        if session is None:
+            session = _sessions[host] = _new_session()
+    return session
+
+
+def get(url, **kwargs):
+    kwargs.setdefault('timeout', TIMEOUT)
+    return session_for(url).get(url, **kwargs)
+
+
+def head(url, **kwargs):
+    kwargs.setdefault('timeout', TIMEOUT)
+    kwargs.setdefault('allow_redirects', True)
+    return session_for(url).head(url, **kwargs)
+
+
+def conditional_get(url, **kwargs):
+    """GET url, revalidating against the last saved copy if there is one.
+
+    Returns (response, cached_path). cached_path is set only when the server
+    answered 304 and the previously saved file is still on disk; otherwise the
+    caller should save the response and call remember().
+    """
+    record = jsonstore.read(_CACHE_PATH).get(url)
+    headers = dict(kwargs.pop('headers', None) or {})
+    if record and os.path.exists(record['path']):
+        if record.get('etag'):
+            headers['If-None-Match'] = record['etag']
+        if record.get('last_modified'):
+            headers['If-Modified-Since'] = record['last_modified']
+    else:
+        record = None
+    r = get(url, headers=headers, **kwargs)
+    if r.status_code == 304 and record:
+        r.close()
+        return r, record['path']
+    return r, None
+
+
+def remember(url, response, path):
+    """Store the response's validators so the next fetch of url can revalidate."""
+    etag = response.headers.get('ETag')
+    last_modified = response.headers.get('Last-Modified')
+    if not etag and not last_modified:
+        return
+
+    def mutate(records):
+        records[url] = {
+            'etag': etag,
+            'last_modified': last_modified,
+            'path': path,
+            'saved_at': time.time(),
+        }
+        for stale in [u for u, rec in records.items() if not os.path.exists(rec['path'])]:
+            del records[stale]
+        if len(records) > _MAX_VALIDATORS:
+            oldest = sorted(records, key=lambda u: records[u]['saved_at'])
+            for u in oldest[:len(records) - _MAX_VALIDATORS]:
+                del records[u]
+
+    jsonstore.update(_CACHE_PATH, mutate)
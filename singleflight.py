@@ -0,0 +1,76 @@
+"""singleflight.py — collapse concurrent identical work into a single call.
+
+do(key, fn) runs fn once for every caller that arrives while a call for the
+same key is in flight; the others wait and get the same result or exception.
+With lock_path, the call also holds an exclusive flock on that file, so other
+processes (a second worker, the cron scripts) queue behind it instead of
+repeating the work. fn should re-check its cache first: whoever held the lock before may
+already have done the job.
+"""
+
+import contextlib
+import fcntl
+import os
+import threading
+import time
+
+
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+@contextlib.contextmanager
+def _file_lock(path, poll_interval=0.05):
+    """Hold an exclusive flock on path.
+
+    Polls with LOCK_NB rather than blocking, so that under the gevent worker a
+    waiting request sleeps cooperatively instead of stalling the whole process.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'a') as f:
+        while True:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                time.sleep(poll_interval)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def do(key, fn, lock_path=None):
+    with _inflight_lock:
+        call = _inflight.get(key)
+        leader = call is None
+        if leader:
+            call = _inflight[key] = _Call()
+
+    if not leader:
+        call.done.wait()
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    try:
+        if lock_path:
+            with _file_lock(lock_path):
+                call.result = fn()
+        else:
+            call.result = fn()
+    except BaseException as e:
+        call.error = e
+        raise
+    finally:
+        with _inflight_lock:
+            del _inflight[key]
+        call.done.set()
+    return call.result
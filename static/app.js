@@ -5,6 +5,7 @@ let allConfigs = {};  // {name: [keys]}
 let defaultPapers = [];
 let selectedPapers = [];  // ordered list of paper keys
 let updateCarouselArrows = () => {};  // set by bindCarousel
+const VARIANT_WIDTHS = [320, 640, 960];  // must match cache.VARIANT_WIDTHS
 
 // ---------------------------------------------------------------------------
 // Boot
@@ -257,10 +258,12 @@ function loadColumnImage(col, key) {
   const img = new Image();
   img.loading = 'eager';
 
+  const src = `/api/paper/${encodeURIComponent(key)}?date=${today}`;
+
   img.onload = () => {
     const placeholder = col.querySelector('.loading, .error');
     if (placeholder) placeholder.replaceWith(img);
-    img.addEventListener('click', () => openZoom(img.src));
+    img.addEventListener('click', () => openZoom(src));
   };
 
   img.onerror = () => {
@@ -271,7 +274,12 @@ function loadColumnImage(col, key) {
     if (placeholder) placeholder.replaceWith(err);
   };
 
-  img.src = `/api/paper/${encodeURIComponent(key)}?date=${today}`;
+  // Let the browser pick a server-side variant sized for the column; the
+  // zoom modal still loads the full-size cover.
+  const colWidth = `min(520px, ${Math.max(1, Math.floor(100 / Math.max(1, selectedPapers.length)))}vw)`;
+  img.sizes = `(max-width: 768px) 76vw, ${colWidth}`;
+  img.srcset = VARIANT_WIDTHS.map(w => `${src}&w=${w} ${w}w`).join(', ');
+  img.src = src;
 }
 
 // ---------------------------------------------------------------------------